@@ -4,6 +4,10 @@ from .models import Constants, Subsession, Group, Player, Bid
 from .pages import page_sequence
 
 from wallet import Wallet
+from bootstrap import timed
+from grouping import group_by_config
+
+import reports
 
 from typing import Any, List, Set
 
@@ -17,10 +21,13 @@ doc = __doc__
 
 
 # Session initialization
+@timed
 def creating_session(subsession: Subsession) -> None:
     """Intialize group and player values in first subsession of session."""
 
     if subsession.round_number == 1:
+        group_by_config(subsession, Constants.group_size)
+
         # Check various conditions necessary for session setup
         N_hard = subsession.session.config.get('num_groups_hard', 0)
         N_candle = subsession.session.config.get('num_groups_candle', 0)
@@ -66,7 +73,7 @@ def vars_for_admin_report(subsession):
     highest_candle = []
     winning_candle = []
 
-    for group in subsession.get_groups():
+    for group in reports.groups(Group, subsession):
         count = Bid.count(group)
         count_all += [ count ]
 
@@ -143,12 +150,20 @@ def custom_export(all_players: List[Player]):
         'bid_price',
     ]
 
+    # Decode the archive of each group only once for all of its players
+    group_bids = {}
+
+    def bids_of(group: Group) -> List[Bid]:
+        if group.id not in group_bids:
+            group_bids[group.id] = Bid.for_group(group)
+        return group_bids[group.id]
+
     for player in all_players:
         session_code = player.session.code
         participant = player.participant
         group = player.group
 
-        for bid in Bid.for_player(player):
+        for bid in Bid.for_player(player, bids_of(group)):
             yield [
                 session_code,
                 participant.code,
@@ -173,7 +188,7 @@ def custom_export(all_players: List[Player]):
     ]
 
     for player in all_players:
-        bid = Bid.result(player.group)
+        bid = Bid.result(player.group, bids_of(player.group))
 
         winner = (bid.player == player) if bid else False
         price = bid.price if winner else ""
@@ -185,7 +200,7 @@ def custom_export(all_players: List[Player]):
                 wallet.public,
                 wallet.balance,
                 len(wallet.games),
-                len(Bid.for_player(player)),
+                len(Bid.for_player(player, bids_of(player.group))),
                 winner,
                 price,
             ]
@@ -8,14 +8,19 @@ from otree.database import (
     BooleanField,
     IntegerField,
     FloatField,
+    LongStringField,
     RealWorldCurrencyField,
 )
-from otree.models import BaseSubsession, BaseGroup
-from wallet import WalletPlayer
+from otree.models import BaseGroup
+from bootstrap import BootstrapSubsession
+from wallet import Wallet, WalletPlayer
 
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 
+import base64
+import json
 import time
+import zlib
 
 
 # MODELS
@@ -23,7 +28,9 @@ class Constants(BaseConstants):
     """Collection of configuration constants."""
 
     name_in_url = 'academy_auction'
-    players_per_group = 3
+    players_per_group = None
+    # Default group size, can be overwritten by session config
+    group_size = 3
     num_rounds = 1
     title_prefix = "Lesson 2.3: "
 
@@ -38,7 +45,7 @@ class Constants(BaseConstants):
     activity_duration = 30.0
 
 
-class Subsession(BaseSubsession):
+class Subsession(BootstrapSubsession):
     """One round of auction."""
 
     pass
@@ -65,6 +72,19 @@ class Group(BaseGroup):
         """Return treatment from underlying participant."""
         return self.field_display('_treatment')
 
+    def snapshot_valuations(self) -> None:
+        """Determine valuations of all bidders from one batch of wallet balances."""
+        players = self.get_players()
+        balances = Wallet.balances([p.participant for p in players])
+
+        for player in players:
+            player.valuation = balances[player.participant.id]
+
+            # Reconcile player that can not participate
+            if player.valuation <= 0:
+                player.payoff = RealWorldCurrency(0)
+                player.participant.finished = True
+
     def timer_start(self) -> None:
         """Start auction timer of group."""
         self.timestamp_start = time.monotonic()
@@ -168,13 +188,7 @@ class Bid(ExtraModel):
     @property
     def profit(self) -> RealWorldCurrency:
         """Return difference between valuation and price of bid."""
-        valuation = self.valuation
-
-        # TODO: Check if this warning is necessary
-        if valuation == 0:
-            print("WARNING: no valuation for {} bid".format(self.price))
-
-        return valuation - self.price
+        return self.valuation - self.price
 
     class SubmissionFailure(Exception):
         """Failure to create valid bid with supplied data."""
@@ -229,37 +243,153 @@ class Bid(ExtraModel):
 
     @staticmethod
     def count(group: Group) -> int:
-        """Return number of bids in group."""
-        return Bid.objects_filter(group=group).count()
+        """Return number of bids in group, including archived ones."""
+        return Bid.objects_filter(group=group).count() + BidArchive.count(group)
 
     @staticmethod
-    def for_player(player: Player) -> List["Bid"]:
-        """Return all bids of a certain player."""
-        return Bid.objects_filter(group=player.group, player=player).order_by('timestamp').all()
+    def for_player(player: Player, bids: Optional[List["Bid"]] = None) -> List["Bid"]:
+        """Return all bids of a certain player, including archived ones.
+
+        Pass all bids of the group from for_group to only decode its archive once for all players.
+        """
+        if bids is None:
+            bids = Bid.objects_filter(group=player.group, player=player).all()
+            bids += [bid for bid in BidArchive.restore(player.group) if bid.player == player]
+        else:
+            bids = [bid for bid in bids if bid.player == player]
+
+        return sorted(bids, key=lambda bid: bid.timestamp)
 
     @staticmethod
     def for_group(group: Group, timestamp: Optional[float] = None) -> List["Bid"]:
-        """Return all bids for a certain group and optionally until a certain timestamp."""
+        """Return all bids for a certain group and optionally until a certain timestamp, including archived ones."""
+        bids = Bid.live_for_group(group, timestamp) + BidArchive.restore(group, timestamp)
+
+        return sorted(bids, key=lambda bid: bid.timestamp)
+
+    @staticmethod
+    def live_for_group(group: Group, timestamp: Optional[float] = None) -> List["Bid"]:
+        """Return bids still kept in the live table, optionally until a certain timestamp."""
         if timestamp:
             return Bid.objects_filter(Bid.timestamp <= timestamp, group=group).order_by('timestamp').all()
         else:
             return Bid.objects_filter(group=group).order_by('timestamp').all()
 
     @staticmethod
-    def highest(group: Group, timestamp: Optional[float] = None) -> Optional["Bid"]:
-        """Return highest bid for a certain group and optionally until a certain timestamp."""
+    def highest(
+        group: Group, timestamp: Optional[float] = None, bids: Optional[List["Bid"]] = None
+    ) -> Optional["Bid"]:
+        """Return highest bid for a certain group and optionally until a certain timestamp.
+
+        Pass all bids of the group from for_group to not decode its archive again.
+        """
+        # Compaction keeps the overall and the deciding highest bid live, highest bids
+        # until any other timestamp may only be found in the archive
+        if bids is not None:
+            bids = [bid for bid in bids if not timestamp or bid.timestamp <= timestamp]
+        elif timestamp and BidArchive.objects_exists(group=group):
+            bids = Bid.for_group(group, timestamp)
+        else:
+            bids = Bid.live_for_group(group, timestamp)
+
         result = None
-        for bid in Bid.for_group(group, timestamp):
+        for bid in bids:
             if not result or result.price < bid.price:
                 result = bid
 
         return result
 
     @staticmethod
-    def result(group: Group) -> Optional["Bid"]:
+    def result(group: Group, bids: Optional[List["Bid"]] = None) -> Optional["Bid"]:
         """Return highest bid for a certain group based on candle duration."""
         timestamp = None
         if group.treatment == "candle":
             timestamp = float(group.candle_duration)
 
-        return Bid.highest(group, timestamp)
+        return Bid.highest(group, timestamp, bids)
+
+    @staticmethod
+    def compact(group: Group) -> int:
+        """Move superseded bids of a finished auction into the archive, return number of archived bids."""
+        keep = {bid for bid in (Bid.highest(group), Bid.result(group)) if bid}
+        superseded = [bid for bid in Bid.live_for_group(group) if bid not in keep]
+
+        if superseded:
+            BidArchive.store(group, superseded)
+
+            for bid in superseded:
+                bid.delete()
+
+        return len(superseded)
+
+
+class ArchivedBid(NamedTuple):
+    """Read-only stand-in for a bid restored from the archive."""
+
+    group: Group
+    player: Player
+    price: RealWorldCurrency
+    timestamp: float
+
+    @property
+    def bidder(self) -> int:
+        """Return unique bidder id within his bidding group."""
+        return self.player.id_in_group
+
+    @property
+    def valuation(self) -> RealWorldCurrency:
+        """Return how bidder valuates this bid."""
+        return self.player.valuation
+
+    @property
+    def profit(self) -> RealWorldCurrency:
+        """Return difference between valuation and price of bid."""
+        return self.valuation - self.price
+
+
+class BidArchive(ExtraModel):
+    """Compressed storage of superseded bids of finished auctions."""
+
+    # Auction the bids belong to
+    group = Link(Group)
+    # Number of bids, to count without decompressing
+    size = IntegerField()
+    # Compressed list of bidder, price and timestamp
+    data = LongStringField()
+
+    @staticmethod
+    def encode(bids: List[Bid]) -> str:
+        """Compress bids into an ascii safe string."""
+        rows = [(bid.bidder, float(bid.price), bid.timestamp) for bid in bids]
+        return base64.b64encode(zlib.compress(json.dumps(rows).encode())).decode()
+
+    @staticmethod
+    def decode(data: str) -> List[tuple]:
+        """Decompress bids into rows of bidder, price and timestamp."""
+        return json.loads(zlib.decompress(base64.b64decode(data)))
+
+    @staticmethod
+    def store(group: Group, bids: List[Bid]) -> None:
+        """Append bids to the archive of a group."""
+        BidArchive.create(group=group, size=len(bids), data=BidArchive.encode(bids))
+
+    @staticmethod
+    def count(group: Group) -> int:
+        """Return number of archived bids of a group."""
+        return sum(archive.size for archive in BidArchive.objects_filter(group=group))
+
+    @staticmethod
+    def restore(group: Group, timestamp: Optional[float] = None) -> List[ArchivedBid]:
+        """Return archived bids of a group, optionally until a certain timestamp."""
+        archives = BidArchive.objects_filter(group=group).all()
+        if not archives:
+            return []
+
+        players = {p.id_in_group: p for p in group.get_players()}
+
+        return [
+            ArchivedBid(group, players[bidder], RealWorldCurrency(price), bid_timestamp)
+            for archive in archives
+            for bidder, price, bid_timestamp in BidArchive.decode(archive.data)
+            if not timestamp or bid_timestamp <= timestamp
+        ]
@@ -7,20 +7,23 @@ from typing import Tuple
 
 from .models import Constants, Player, Group, Bid
 
+import broadcast
+
 
 class IntroPage(Page):
     """Introduction page explaining auction mechanics."""
 
     timeout_seconds = 120
 
-    @staticmethod
-    def before_next_page(player: Player, timeout_happened: bool):
-        """Determine valuation and reconcile player that can not participate."""
-        player.valuation = player.balance
 
-        if player.valuation <= 0:
-            player.payoff = RealWorldCurrency(0)
-            player.participant.finished = True
+class ValuationWaitPage(WaitPage):
+    """Wait page before auction to determine valuations of all players."""
+
+    @staticmethod
+    def after_all_players_arrive(group: Group):
+        """Determine valuations and reconcile players that can not participate."""
+        # Snapshot all wallet balances at once instead of one walk per bidder
+        group.snapshot_valuations()
 
 
 class AuctionWaitPage(WaitPage):
@@ -90,6 +93,9 @@ class AuctionPage(Page):
         # Save time of reception
         timestamp = player.group.timestamp()
 
+        # Any message, including the initial request, marks player as present
+        broadcast.subscribe(player.group, 'AuctionPage', player.id_in_group, initial=not data)
+
         # Return values
         status = "init"
         payload = None
@@ -117,11 +123,8 @@ class AuctionPage(Page):
             payload = AuctionPage.get_highest(player.group)
 
         if status == "success":
-            # Successful bids send updates to everybody
-            return {
-                pid: (status if pid == player.id_in_group else "update", payload)
-                for pid in range(1, Constants.players_per_group + 1)
-            }
+            # Successful bids send updates to everybody still on the page
+            return broadcast.broadcast(player.group, 'AuctionPage', player.id_in_group, status, payload)
 
         # Any other request or outcome is only reported to the sender
         return {
@@ -131,6 +134,8 @@ class AuctionPage(Page):
     @staticmethod
     def before_next_page(player: Player, timeout_happened: bool):
         """Make sure page was submitted by timeout."""
+        broadcast.unsubscribe(player.group, 'AuctionPage', player.id_in_group)
+
         if timeout_happened: # Logic seems to be inverted for some reason
             player.auction_skipped = True
             print("Warning: Player ended auction before timeout!")
@@ -159,6 +164,9 @@ class ResultWaitPage(WaitPage):
 
             player.participant.finished = True
 
+        # Auction is over, only the deciding bids need to stay in the live table
+        Bid.compact(group)
+
 
 class ResultPage(Page):
     """Page to display results at end of auction."""
@@ -178,6 +186,7 @@ class ResultPage(Page):
 
 page_sequence = [
     IntroPage,
+    ValuationWaitPage,
     AuctionWaitPage,
     AuctionPage,
     ResultWaitPage,
@@ -1,12 +1,18 @@
 """A Cournot competition where unit sell price depends on total units produced."""
 
 from otree.constants import BaseConstants
-from otree.models import BaseSubsession, BaseGroup, BasePlayer
+from otree.models import BaseGroup, BasePlayer
 from otree.database import CurrencyField, IntegerField
 
 from otree.views import Page, WaitPage
 
+from bootstrap import BootstrapSubsession
+
+from typing import List, Optional, Tuple
+
 import json
+import payoffs
+import reports
 
 
 doc = __doc__
@@ -24,9 +30,14 @@ class C(BaseConstants):
     # Total production capacity of all players
     TOTAL_CAPACITY = 60
     MAX_UNITS_PER_PLAYER = int(TOTAL_CAPACITY / PLAYERS_PER_GROUP)
+    # Unit price by total units produced, shared table
+    PRICES = payoffs.cournot_prices(TOTAL_CAPACITY, MAX_UNITS_PER_PLAYER * PLAYERS_PER_GROUP)
+    # Group sizes and capacities compared in admin report, can be overwritten by session config
+    EXPLORE_GROUP_SIZES = "1,2,3,4,5"
+    EXPLORE_CAPACITIES = str(TOTAL_CAPACITY)
 
 
-class Subsession(BaseSubsession):
+class Subsession(BootstrapSubsession):
     """Plain default subsession."""
 
     pass
@@ -90,11 +101,13 @@ class ResultWaitPage(WaitPage):
         players = group.get_players()
 
         group.total_units = sum(p.units for p in players)
-        group.unit_price = C.TOTAL_CAPACITY - group.total_units
+        group.unit_price = C.PRICES[group.total_units]
 
         for p in players:
             p.payoff = group.unit_price * p.units
 
+        reports.invalidate(group.session)
+
 
 class ResultPage(Page):
     """Page to display result to players."""
@@ -110,29 +123,48 @@ class ResultPage(Page):
 page_sequence = [IntroPage, DecisionPage, ResultWaitPage, ResultPage]
 
 
-def vars_for_admin_report(subsession):
-    session = subsession.session
+def parse_numbers(value: str) -> List[int]:
+    """Parse comma separated list of positive numbers."""
+    return [int(n) for n in str(value).split(',') if n.strip() and int(n) > 0]
 
-    units_avg = [None] * C.NUM_ROUNDS
-    price_avg = [None] * C.NUM_ROUNDS
 
-    for round in range(1, C.NUM_ROUNDS + 1):
+def explore(config: dict) -> List[Tuple[int, int, Optional[payoffs.Outcome], payoffs.Outcome]]:
+    """Return symmetric nash and collusive outcome of every configured capacity and group size."""
+    capacities = parse_numbers(config.get('academy_cournot_capacities', C.EXPLORE_CAPACITIES))
+    sizes = parse_numbers(config.get('academy_cournot_group_sizes', C.EXPLORE_GROUP_SIZES))
 
-        subsession = Subsession.objects_get(session=session, round_number=round)
+    rows = []
+    for capacity in capacities:
+        for size in sizes:
+            # Same production limit per player as the game itself
+            grid = payoffs.cournot_grid(capacity, capacity // size, size)
+            nash = grid.nash()
 
-        units = [p.field_maybe_none('units') for p in subsession.get_players()]
-        units = [u for u in units if u is not None]
+            rows.append((capacity, size, nash[0] if nash else None, grid.collusive()))
+
+    return rows
+
+
+def vars_for_admin_report(subsession):
+    session = subsession.session
 
-        prices = [g.field_maybe_none('unit_price') for g in subsession.get_groups()]
-        prices = [p for p in prices if p is not None]
+    players = reports.columns(Player, session, C.NUM_ROUNDS, 'units')
+    groups = reports.columns(Group, session, C.NUM_ROUNDS, 'unit_price')
 
-        if units:
-            units_avg[round - 1] = sum(units) / len(units)
+    units_avg = [reports.mean(r['units']) for r in players]
+    price_avg = [reports.mean(r['unit_price']) for r in groups]
 
-        if prices:
-            price_avg[round - 1] = float(sum(prices) / len(prices))
+    # Reference outcomes of the game as played, drawn as constant series
+    grid = payoffs.cournot_grid(C.TOTAL_CAPACITY, C.MAX_UNITS_PER_PLAYER, C.PLAYERS_PER_GROUP)
+    nash = grid.nash()
+    collusive = grid.collusive()
 
     return dict(
         units=json.dumps(units_avg),
         prices=json.dumps(price_avg),
+        units_nash=json.dumps([nash[0].units] * C.NUM_ROUNDS if nash else []),
+        units_collusive=json.dumps([collusive.units] * C.NUM_ROUNDS),
+        prices_nash=json.dumps([nash[0].price] * C.NUM_ROUNDS if nash else []),
+        prices_collusive=json.dumps([collusive.price] * C.NUM_ROUNDS),
+        outcomes=explore(session.config),
     )
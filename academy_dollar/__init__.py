@@ -2,14 +2,32 @@
 
 import time
 
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
 from otree.constants import BaseConstants
 from otree.currency import RealWorldCurrency
-from otree.models import BaseSubsession, BaseGroup, BasePlayer
-from otree.database import BooleanField, RealWorldCurrencyField, IntegerField
+from otree.models import BaseGroup, BasePlayer
+from otree.database import (
+    ExtraModel,
+    Link,
+    BooleanField,
+    FloatField,
+    RealWorldCurrencyField,
+    IntegerField,
+)
+
+from sqlalchemy import Numeric, cast
+from sqlalchemy.orm import object_session
 
 from otree.views import Page, WaitPage
 
+from bootstrap import BootstrapSubsession, timed
 from wallet import WalletPlayer
+from grouping import group_by_config
+
+import broadcast
+import reports
 
 
 doc = __doc__
@@ -18,15 +36,21 @@ doc = __doc__
 # MODELS
 class C(BaseConstants):
     NAME_IN_URL = 'academy_dollar'
-    PLAYERS_PER_GROUP = 5
+    PLAYERS_PER_GROUP = None
+    # Default group size, can be overwritten by session config
+    GROUP_SIZE = 5
     NUM_ROUNDS = 1
     TITLE_PREFIX = "Lesson 2.3: "
     INSTRUCTIONS_TEMPLATE = 'academy_dollar/instructions.html'
     JACKPOT = RealWorldCurrency(1.00)
     INCREMENT = RealWorldCurrency(0.05)
+    # Time in s participants can bid once the auction opened
+    BID_DURATION = 90
+    # Number of logged bids kept in memory before writing them out
+    BID_LOG_BUFFER = 25
 
 
-class Subsession(BaseSubsession):
+class Subsession(BootstrapSubsession):
     pass
 
 
@@ -37,21 +61,122 @@ class Group(BaseGroup):
     second_price = RealWorldCurrencyField(initial=0)
     second_player = IntegerField(initial=0)
 
+    # Wall clock time at which bidding closes
+    deadline = FloatField()
+
+    def open_bidding(self) -> None:
+        """Fix auction deadline for the whole group and cache it."""
+        self.deadline = time.time() + C.BID_DURATION
+        AUCTION_DEADLINES[self.id] = self.deadline
+
+    def has_timed_out(self) -> bool:
+        """Check if bidding has closed, only hits the database after a restart."""
+        deadline = AUCTION_DEADLINES.get(self.id)
+        if deadline is None:
+            deadline = self.field_maybe_none('deadline')
+            if deadline is None:
+                return False
+
+            AUCTION_DEADLINES[self.id] = deadline
+
+        return deadline < time.time()
+
+    def outbid(self, player_id: int, price: RealWorldCurrency) -> bool:
+        """Atomically replace highest bid if price exceeds it, return if bid was accepted."""
+        # Compare-and-swap in a single conditional update, old values are shifted down,
+        # prices are stored as text and need to be compared as numbers
+        accepted = Group.objects_filter(
+            Group.id == self.id,
+            cast(Group.first_price, Numeric) < float(price),
+            Group.first_player != player_id,
+        ).update({
+            Group.second_price: Group.first_price,
+            Group.second_player: Group.first_player,
+            Group.first_price: price,
+            Group.first_player: player_id,
+        }, synchronize_session=False)
+
+        # Reload bidding state as left by whichever worker won the race
+        object_session(self).expire(self, [
+            'first_price', 'first_player', 'second_price', 'second_player'
+        ])
+
+        return bool(accepted)
+
+
+# Auction deadlines by group id, saves a participant load per bid
+AUCTION_DEADLINES: Dict[int, float] = {}
+
 
 class Player(WalletPlayer):
 
     # Players endowment, determines how high they can bid
     endowment = RealWorldCurrencyField()
 
-    # Check otree's timer structure for time outs
+    # Compare against the group deadline instead of otree's per participant timer
     def has_timed_out(self):
-        pp = self.participant
+        return self.group.has_timed_out()
 
-        return (
-            pp._timeout_page_index == pp._index_in_pages
-            and pp._timeout_expiration_time is not None
-            and (pp._timeout_expiration_time < time.time())
-        )
+
+# EXTRA MODELS
+class BidLog(ExtraModel):
+    """Append-only log of every bid attempt."""
+
+    group = Link(Group)
+    bidder = IntegerField()
+    price = RealWorldCurrencyField()
+    accepted = BooleanField()
+    timestamp = FloatField()
+
+    State = Tuple[RealWorldCurrency, int, RealWorldCurrency, int]
+
+    @staticmethod
+    def append(group: Group, bidder: int, price: RealWorldCurrency, accepted: bool) -> None:
+        """Queue bid attempt in memory and only write out full buffers."""
+        pending = BID_LOG_PENDING[group.id]
+        pending.append(dict(
+            group_id=group.id,
+            bidder=bidder,
+            price=price,
+            accepted=accepted,
+            timestamp=time.time(),
+        ))
+
+        if len(pending) >= C.BID_LOG_BUFFER:
+            BidLog.flush(group.id)
+
+    @staticmethod
+    def flush(group_id: Optional[int] = None) -> None:
+        """Write pending bid attempts of one or all groups to the database."""
+        group_ids = [group_id] if group_id else list(BID_LOG_PENDING)
+
+        for gid in group_ids:
+            for entry in BID_LOG_PENDING.pop(gid, []):
+                BidLog.create(**entry)
+
+    @staticmethod
+    def advance(state: "BidLog.State", bidder: int, price: RealWorldCurrency) -> "BidLog.State":
+        """Return auction state after an accepted bid."""
+        return price, bidder, state[0], state[1]
+
+    @staticmethod
+    def replay(group: Group, timestamp: Optional[float] = None) -> "BidLog.State":
+        """Reconstruct first and second bid of a group, optionally as it was at a certain timestamp."""
+        BidLog.flush(group.id)
+
+        query = BidLog.objects_filter(group=group, accepted=True)
+        if timestamp is not None:
+            query = query.filter(BidLog.timestamp <= timestamp)
+
+        state = (RealWorldCurrency(0), 0, RealWorldCurrency(0), 0)
+        for entry in query.order_by('timestamp'):
+            state = BidLog.advance(state, entry.bidder, entry.price)
+
+        return state
+
+
+# Bid attempts not yet written, by group id
+BID_LOG_PENDING: Dict[int, List[dict]] = defaultdict(list)
 
 
 class Intro(Page):
@@ -65,15 +190,21 @@ class Intro(Page):
 
 
 class WaitToStart(WaitPage):
-    pass
+    @staticmethod
+    def after_all_players_arrive(group: Group):
+        group.open_bidding()
 
 
 # PAGES
 class Bid(Page):
 
-    timeout_seconds = 90
     timer_text = "Time left till auction will end:"
 
+    @staticmethod
+    def get_timeout_seconds(player: Player):
+        """Align page timer with the group deadline."""
+        return player.group.deadline - time.time()
+
     @staticmethod
     def js_vars(player: Player):
         return {
@@ -86,6 +217,9 @@ class Bid(Page):
 
         group = player.group
 
+        # Any message, including the initial request, marks player as present
+        broadcast.subscribe(group, 'Bid', player.id_in_group, initial=not data)
+
         # Return values
         status = "init"
         payload = None
@@ -94,6 +228,8 @@ class Bid(Page):
         if data:
             price = RealWorldCurrency(data)
 
+            accepted = False
+
             if player.has_timed_out():
                 # Bid was submitted after auction ended
                 status = "error"
@@ -102,23 +238,24 @@ class Bid(Page):
                 # Bid exceeds available funds
                 status = "error"
                 payload = "Price exceeds your available funds of {}".format(player.endowment)
-            elif price <= group.first_price:
-                # Bid is to low change outcome
-                status = "error"
-                payload = "Price has to exceed current highest bid of {}".format(group.first_price)
+            elif group.outbid(player.id_in_group, price):
+                # Bid passed all checks and is highest bid
+                status = "success"
+                accepted = True
             elif group.first_player == player.id_in_group:
                 # Player is already highest bidder
                 status = "error"
                 payload = "You are already the highest bidder."
+            elif price <= group.first_price:
+                # Bid is to low change outcome
+                status = "error"
+                payload = "Price has to exceed current highest bid of {}".format(group.first_price)
             else:
-                # Bid passed all checks and is highest bid
-                status = "success"
-
-                group.second_price = group.first_price
-                group.second_player = group.first_player
+                # Highest bid changed while the bid was placed
+                status = "error"
+                payload = "Your bid was overtaken by another bid, please try again."
 
-                group.first_price = price
-                group.first_player = player.id_in_group
+            BidLog.append(group, player.id_in_group, price, accepted)
 
         if not payload:
             # Return latest auction state by default
@@ -131,21 +268,27 @@ class Bid(Page):
             )
 
         if status == "success":
-            # Successful bids send updates to everybody
-            return {
-                pid: (status if pid == player.id_in_group else "update", payload)
-                for pid in range(1, C.PLAYERS_PER_GROUP + 1)
-            }
+            # Successful bids send updates to everybody still on the page
+            return broadcast.broadcast(group, 'Bid', player.id_in_group, status, payload)
 
         # Any other request or outcome is only reported to the sender
         return {
             player.id_in_group: (status, payload)
         }
 
+    @staticmethod
+    def before_next_page(player: Player, timeout_happened: bool):
+        """Stop sending updates to player."""
+        broadcast.unsubscribe(player.group, 'Bid', player.id_in_group)
+
 
 class ResultsWaitPage(WaitPage):
     @staticmethod
     def after_all_players_arrive(group: Group):
+        # Bidding is over, persist remaining log entries
+        BidLog.flush(group.id)
+        AUCTION_DEADLINES.pop(group.id, None)
+
         currency_ratio = group.session.config['real_world_currency_per_point']
 
         # Calculate first bidder payoff
@@ -169,11 +312,16 @@ class Results(Page):
 page_sequence = [Intro, WaitToStart, Bid, ResultsWaitPage, Results]
 
 
+@timed
+def creating_session(subsession: Subsession):
+    group_by_config(subsession, C.GROUP_SIZE)
+
+
 # CUSTOM ADMIN REPORT
 def vars_for_admin_report(subsession):
     prices = []
 
-    for group in subsession.get_groups():
+    for group in reports.groups(Group, subsession):
         if group.first_player:
             prices += [ group.first_price ]
 
@@ -189,3 +337,53 @@ def vars_for_admin_report(subsession):
             price_average="-",
             price_lowest="-",
        )
+
+
+# CUSTOM EXPORTER
+def custom_export(all_players: List[Player]):
+    """Stream bid log with the auction state after every attempt."""
+    yield [
+        'session_code',
+        'group_id',
+        'bid_timestamp',
+        'bid_player',
+        'bid_price',
+        'bid_accepted',
+        'first_player',
+        'first_price',
+        'second_player',
+        'second_price',
+    ]
+
+    BidLog.flush()
+
+    groups = {p.group_id: p for p in all_players}
+
+    entries = BidLog.objects_filter(BidLog.group_id.in_(list(groups))).order_by(
+        BidLog.group_id, BidLog.timestamp
+    ).yield_per(500)
+
+    group_id = None
+    state = None
+    for entry in entries:
+        if entry.group_id != group_id:
+            group_id = entry.group_id
+            state = (RealWorldCurrency(0), 0, RealWorldCurrency(0), 0)
+
+        if entry.accepted:
+            state = BidLog.advance(state, entry.bidder, entry.price)
+
+        player = groups[group_id]
+
+        yield [
+            player.session.code,
+            player.group.id_in_subsession,
+            entry.timestamp,
+            entry.bidder,
+            entry.price,
+            entry.accepted,
+            state[1],
+            state[0],
+            state[3],
+            state[2],
+        ]
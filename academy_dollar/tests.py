@@ -0,0 +1,37 @@
+from otree.api import Currency as c, currency_range, expect, Bot
+from . import *
+
+
+def call_live_method(method, page_class, group, **kwargs):
+    if page_class != Bid:
+        return
+
+    # Bots have no wallet, give everyone enough funds to bid past ten
+    for player in group.get_players():
+        player.endowment = RealWorldCurrency(20)
+
+    expect(method(1, 9.95)[1][0], 'success')
+
+    # Crossing a digit boundary needs a numeric comparison, as text '10.00' < '9.95'
+    expect(method(2, 10.00)[2][0], 'success')
+    expect(method(1, 10.05)[1][0], 'success')
+
+    status, message = method(1, 10.10)[1]
+    expect(status, 'error')
+    expect('already the highest bidder', 'in', message)
+
+    status, message = method(2, 9.99)[2]
+    expect(status, 'error')
+    expect('exceed current highest bid', 'in', message)
+
+    expect(group.first_player, 1)
+    expect(group.first_price, RealWorldCurrency(10.05))
+    expect(group.second_player, 2)
+    expect(group.second_price, RealWorldCurrency(10.00))
+
+
+class PlayerBot(Bot):
+    def play_round(self):
+        yield Intro
+        yield Bid
+        yield Results
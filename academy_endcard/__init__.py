@@ -1,14 +1,32 @@
 """End-of-session app that displays participants progress."""
 
 from otree.constants import BaseConstants
-from otree.currency import RealWorldCurrency
-from otree.models import BaseSubsession, BaseGroup
-from otree.database import db, MixinSessionFK
+from otree.currency import Currency, RealWorldCurrency
+from otree.models import BaseSubsession, BaseGroup, Participant, Session
+from otree.database import (
+    db,
+    ExtraModel,
+    Link,
+    CurrencyField,
+    FloatField,
+    RealWorldCurrencyField,
+    StringField,
+    MixinSessionFK,
+)
 from otree.views import Page, WaitPage
 
-from wallet import WalletPlayer
+from bootstrap import BootstrapSubsession
+from wallet import Wallet, WalletPlayer
 
+from sqlalchemy import Numeric, cast, func
+
+from typing import BinaryIO, Dict, List, Optional
+
+import gzip
+import json
 import logging
+import shards
+import time
 
 
 logger = logging.getLogger('academy')
@@ -30,8 +48,37 @@ class C(BaseConstants):
         """Return if app should allow user to create new wallets."""
         return RealWorldCurrency(model.session.config.get('academy_endcard_reward', 0))
 
+    @staticmethod
+    def get_share(session: Session, reward: RealWorldCurrency) -> RealWorldCurrency:
+        """Return part of the reward paid out by this session, shards of a room split one reward.
+
+        Every shard claims its part by visited participants across all shards, capped at what
+        earlier shards left over, so shards opened after others paid out can only receive the rest.
+        """
+        ids = shards.session_ids(session)
+        if len(ids) == 1:
+            return reward
+
+        visited = dict(
+            Participant.objects_filter(Participant.session_id.in_(ids), visited=True).with_entities(
+                Participant.session_id, func.count(Participant.id)
+            ).group_by(Participant.session_id)
+        )
+        # Amounts are stored as text and need a cast to be summed up
+        paid = Payout.objects_filter(Payout.session_id.in_(ids), Payout.session_id != session.id).with_entities(
+            func.sum(cast(Payout.amount, Numeric))
+        ).scalar() or 0
+
+        return C.split(reward, visited, session.id, paid)
+
+    @staticmethod
+    def split(reward: RealWorldCurrency, visited: Dict[int, int], session_id: int, paid) -> RealWorldCurrency:
+        """Return part of the reward of one shard by visited participants per shard id and reward paid by others."""
+        share = float(reward) * visited.get(session_id, 0) / max(1, sum(visited.values()))
+        return RealWorldCurrency(max(0.0, min(share, float(reward) - float(paid))))
+
 
-class Subsession(BaseSubsession):
+class Subsession(BootstrapSubsession):
     """Default base subsession."""
 
     pass
@@ -49,6 +96,124 @@ class Player(WalletPlayer):
     pass
 
 
+class RewardTotals:
+    """Running sum and minimum of participants' final payoffs in a session."""
+
+    def __init__(self):
+        self.payoffs: Dict[int, Currency] = {}
+        self.sum = Currency(0)
+        self.min: Optional[Currency] = None
+
+    @property
+    def count(self) -> int:
+        """Return number of participants accounted for."""
+        return len(self.payoffs)
+
+    def add(self, participant_id: int, payoff: Currency) -> None:
+        """Account for final payoff of a participant, only once."""
+        if participant_id in self.payoffs:
+            return
+
+        self.payoffs[participant_id] = payoff
+        self.sum += payoff
+        self.min = payoff if self.min is None else min(self.min, payoff)
+
+    @staticmethod
+    def record(participant: Participant) -> None:
+        """Track final payoff of a participant arriving at the end of the session, only once."""
+        totals = REWARD_TOTALS.setdefault(participant.session_id, RewardTotals())
+        totals.add(participant.id, participant.payoff)
+
+    @staticmethod
+    def load(session: Session) -> "RewardTotals":
+        """Compute totals of all participants of a session in one query."""
+        totals = RewardTotals()
+        for participant_id, payoff in Participant.objects_filter(session=session).with_entities(
+            Participant.id, Participant.payoff
+        ):
+            totals.add(participant_id, payoff)
+
+        return totals
+
+
+# Reward totals by session id, updated as participants arrive
+REWARD_TOTALS: Dict[int, RewardTotals] = {}
+
+
+class Payout(ExtraModel):
+    """Ledger entry of the reward paid out to a participant."""
+
+    session = Link(Session)
+    participant = Link(Participant)
+    # Wallet receiving the payout, if known
+    public = StringField()
+    # Final points and their real world value
+    points = CurrencyField()
+    amount = RealWorldCurrencyField()
+    ratio = FloatField()
+    timestamp = FloatField()
+
+    # Columns of exports and dumps
+    COLUMNS = ['session_code', 'participant_code', 'public', 'points', 'amount', 'ratio', 'timestamp']
+
+    @staticmethod
+    def record(session: Session, totals: RewardTotals, offset: Currency, ratio: float) -> None:
+        """Write payouts of all participants of a session in one batch."""
+        publics = Wallet.publics(totals.payoffs, placeholder=None)
+        timestamp = time.time()
+
+        # Plain mappings are inserted as one batch, objects would be inserted one by one for their ids
+        db._db.bulk_insert_mappings(Payout, [
+            dict(
+                session_id=session.id,
+                participant_id=participant_id,
+                public=publics[participant_id],
+                points=payoff + offset,
+                amount=RealWorldCurrency(float(payoff + offset) * ratio),
+                ratio=ratio,
+                timestamp=timestamp,
+            )
+            for participant_id, payoff in totals.payoffs.items()
+        ])
+
+    @staticmethod
+    def rows(session_ids: Optional[List[int]] = None):
+        """Stream ledger rows in order of payout, optionally limited to some sessions."""
+        query = db.query(Payout).join(Session, Payout.session_id == Session.id).join(
+            Participant, Payout.participant_id == Participant.id
+        )
+
+        if session_ids is not None:
+            query = query.filter(Payout.session_id.in_(session_ids))
+
+        return query.order_by(Payout.id).with_entities(
+            Session.code, Participant.code, Payout.public, Payout.points,
+            Payout.amount, Payout.ratio, Payout.timestamp,
+        ).yield_per(1000)
+
+    @staticmethod
+    def dump(out: BinaryIO, session_ids: Optional[List[int]] = None, chunk: int = 10000) -> int:
+        """Write ledger as gzipped lines of columns per chunk of rows, return number of rows."""
+        count = 0
+
+        with gzip.open(out, 'wt') as stream:
+            columns = {name: [] for name in Payout.COLUMNS}
+
+            for row in Payout.rows(session_ids):
+                for name, value in zip(Payout.COLUMNS, row):
+                    columns[name].append(float(value) if name in ('points', 'amount') else value)
+                count += 1
+
+                if len(columns['session_code']) == chunk:
+                    stream.write(json.dumps(columns) + "\n")
+                    columns = {name: [] for name in Payout.COLUMNS}
+
+            if columns['session_code']:
+                stream.write(json.dumps(columns) + "\n")
+
+        return count
+
+
 # Pages
 class EndWaitPage(WaitPage):
     """Session wide wait page to distribute any reward."""
@@ -63,44 +228,62 @@ class EndWaitPage(WaitPage):
         """Only display page if reward needs distribution."""
         return C.get_reward(player)
 
+    @staticmethod
+    def arrive(player: Player) -> None:
+        """Account for a participant arriving at the end of the session, repeated on every reload."""
+        if C.get_reward(player):
+            RewardTotals.record(player.participant)
+
+    def inner_dispatch(self, request):
+        # Only visits of the participant itself arrive here, while oTree also evaluates
+        # is_displayed when skipping pages, so arrivals are tracked here and not there
+        self.arrive(self.player)
+
+        return super().inner_dispatch(request)
+
     @staticmethod
     def after_all_players_arrive(subsession: BaseSubsession):
-        """Trigger real currency payout based on total reward."""
+        """Trigger real currency payout based on this session's share of the total reward."""
         reward = C.get_reward(subsession)
 
         if reward:
-            participants = [p.participant for p in subsession.get_players()]
-            points = [p.payoff for p in participants]
-            points_min = min(points)
+            session = subsession.session
+            reward = C.get_share(session, reward)
+
+            # Arrivals tracked before a restart are lost, so count them again
+            totals = REWARD_TOTALS.pop(session.id, None)
+            if not totals or totals.count != session.num_participants:
+                totals = RewardTotals.load(session)
+
             points_offset = 0
 
-            if points_min < 0:
-                points_offset = -points_min
+            if totals.min < 0:
+                points_offset = -totals.min
 
-                for p in subsession.get_players():
-                    p.payoff = points_offset
+                # Payoffs are stored as text and can't be added up in SQL, participant payoff follows player payoff
+                for player in Player.objects_filter(subsession=subsession):
+                    player._payoff = points_offset
 
-            points_total = sum(points) + len(points) * points_offset
-            reward_per_point = float(reward) / float(points_total)
+            points_total = totals.sum + totals.count * points_offset
+            reward_per_point = float(reward) / float(points_total) if reward else 0.0
 
-            logger.info(f"reward: '{subsession.session.code}' payoff ratio is {reward_per_point}")
+            logger.info(f"reward: '{session.code}' payoff ratio is {reward_per_point}")
 
-            config = subsession.session.config.copy()
+            # Shards record which part of the shared reward they paid out
+            config = session.config.copy()
             config['real_world_currency_per_point'] = reward_per_point
-            subsession.session.config = config
+            config['academy_endcard_share'] = float(reward)
+            session.config = config
 
-            payoff_total = RealWorldCurrency(0)
-            for p in subsession.get_players():
-                participant = p.participant
-                participant.finished = True
+            Payout.record(session, totals, points_offset, reward_per_point)
 
-                payoff_points = participant.payoff
-                payoff_real = participant.payoff_in_real_world_currency()
-                payoff_total += payoff_real
-
-                logger.info(f"reward: '{participant.code}' receives {payoff_real} ({payoff_points})")
+            # Participants only count as finished once their reward is paid out
+            for participant in Participant.objects_filter(session=session):
+                participant.payoff += points_offset
+                participant.finished = True
 
-            logger.info(f"reward: '{subsession.session.code}' total payoff is {payoff_total}")
+            payoff_total = RealWorldCurrency(float(points_total) * reward_per_point)
+            logger.info(f"reward: '{session.code}' total payoff is {payoff_total} for {totals.count} participants")
 
 
 class EndCard(Page):
@@ -115,3 +298,36 @@ class EndCard(Page):
         )
 
 page_sequence = [EndWaitPage, EndCard]
+
+
+def vars_for_admin_report(subsession):
+    """Sum up payouts of all shards of the session against the reward they share."""
+    session = subsession.session
+    ids = shards.session_ids(session)
+
+    rows = Payout.objects_filter(Payout.session_id.in_(ids)).with_entities(
+        Payout.session_id, func.count(Payout.id), func.sum(cast(Payout.amount, Numeric))
+    ).group_by(Payout.session_id)
+    payouts = {session_id: (count, amount) for session_id, count, amount in rows}
+
+    sessions = [
+        dict(code=shard.code, participants=payouts.get(shard.id, (0, 0))[0],
+             amount=RealWorldCurrency(payouts.get(shard.id, (0, 0))[1] or 0))
+        for shard in shards.siblings(session)
+    ]
+
+    return dict(
+        reward=C.get_reward(subsession),
+        sessions=sessions,
+        paid=RealWorldCurrency(sum(s['amount'] for s in sessions)),
+        participants=sum(s['participants'] for s in sessions),
+    )
+
+
+# CUSTOM EXPORTER
+def custom_export(all_players: List[Player]):
+    """Stream payout ledger of all sessions."""
+    yield Payout.COLUMNS
+
+    for row in Payout.rows():
+        yield list(row)
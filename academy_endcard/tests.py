@@ -0,0 +1,32 @@
+from otree.api import Currency as c, currency_range, expect, Bot
+from . import *
+
+
+def check_share(subsession):
+    """Check that shards split the reward by visited participants and never pay out more than it."""
+    reward = RealWorldCurrency(100)
+
+    # A session without shards pays out the whole reward
+    expect(C.get_share(subsession.session, reward), reward)
+
+    # Shards 1 and 2 with 3 and 1 visited participants
+    visited = {1: 3, 2: 1}
+    expect(C.split(reward, visited, 1, 0), RealWorldCurrency(75))
+    expect(C.split(reward, visited, 2, 0), RealWorldCurrency(25))
+    expect(C.split(reward, visited, 2, 75), RealWorldCurrency(25))
+
+    # Shards paying out later only receive what is left over
+    expect(C.split(reward, visited, 2, 80), RealWorldCurrency(20))
+    expect(C.split(reward, visited, 2, 120), RealWorldCurrency(0))
+
+    # Shards nobody visited receive nothing
+    expect(C.split(reward, visited, 3, 0), RealWorldCurrency(0))
+    expect(C.split(reward, {}, 1, 0), RealWorldCurrency(0))
+
+
+class PlayerBot(Bot):
+    def play_round(self):
+        if self.participant.id_in_session == 1:
+            check_share(self.subsession)
+
+        yield EndCard
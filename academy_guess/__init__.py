@@ -2,15 +2,24 @@
 
 from otree.constants import BaseConstants
 from otree.currency import Currency
-from otree.database import BooleanField, FloatField, IntegerField
-from otree.models import BaseSubsession, BaseGroup, BasePlayer
+from otree.database import BooleanField, FloatField, IntegerField, LongStringField
+from otree.models import BaseGroup, BasePlayer
 
+from otree.channels import utils as channel_utils
+from otree.channels.routing import websocket_routes
 from otree.views import Page, WaitPage
 
-from typing import List, Optional
+from starlette.endpoints import WebSocketEndpoint
+from starlette.routing import WebSocketRoute
+
+from bootstrap import BootstrapSubsession, timed
+from grouping import group_by_config
+
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
 
-import math
 import json
+import reports
 
 doc = __doc__
 
@@ -26,9 +35,14 @@ class C(BaseConstants):
     JACKPOT = Currency(100)
     GUESS_MAX = 100
     INSTRUCTIONS_TEMPLATE = 'academy_guess/instructions.html'
+    # Default relative group sizes and smallest group worth splitting off
+    GROUP_RATIOS = [3, 2, 1]
+    GROUP_MIN_SIZE = 3
+    # Width of live histogram bins
+    HISTOGRAM_BIN = 5
 
 
-class Subsession(BaseSubsession):
+class Subsession(BootstrapSubsession):
     """Default base subsession."""
 
     pass
@@ -41,6 +55,9 @@ class Group(BaseGroup):
     best_guess = IntegerField()
     num_winners = IntegerField()
 
+    # Averages of all rounds up to this one, written once this round is over
+    _history = LongStringField(initial='[]')
+
     @property
     def size(self) -> int:
         return len(self.get_players())
@@ -54,8 +71,90 @@ class Group(BaseGroup):
 
     @property
     def history(self) -> List[Optional[float]]:
-        """Retrieve history of previous averages."""
-        return [g.field_maybe_none('two_thirds_avg') for g in self.in_previous_rounds()]
+        """Retrieve history of previous averages, as stored by the previous round."""
+        if self.round_number == 1:
+            return []
+
+        return json.loads(self.in_round(self.round_number - 1)._history)
+
+    def extend_history(self) -> None:
+        """Store history including this round's average on this round."""
+        self._history = json.dumps(self.history + [self.field_maybe_none('two_thirds_avg')])
+
+
+# Live histogram of the round each group is playing, by session id and group id in subsession,
+# dropped once the group finished its last round and rebuilt from guesses after a restart
+HISTOGRAMS: Dict[Tuple[int, int], Tuple[int, List[int]]] = {}
+
+# Path of the socket pushing histogram updates of a session to its admin report
+HISTOGRAM_PATH = '/academy_guess/histogram/{session_id}'
+
+
+def histogram_labels() -> List[str]:
+    """Return label of each histogram bin."""
+    return [
+        f"{start}-{min(start + C.HISTOGRAM_BIN - 1, C.GUESS_MAX)}"
+        for start in range(0, C.GUESS_MAX + 1, C.HISTOGRAM_BIN)
+    ]
+
+
+def histogram_channel(session_id: int) -> str:
+    """Return channel of admin reports following the histograms of a session."""
+    return f"academy-guess-histogram-{session_id}"
+
+
+def histogram_bins(guesses) -> List[int]:
+    """Count guesses per histogram bin."""
+    counts = [0] * (C.GUESS_MAX // C.HISTOGRAM_BIN + 1)
+    for guess in guesses:
+        counts[guess // C.HISTOGRAM_BIN] += 1
+
+    return counts
+
+
+def rebuild_histograms(session_ids: List[int]) -> None:
+    """Restore histograms of groups still playing from their latest guesses, e.g. after a restart."""
+    latest: Dict[Tuple[int, int], Tuple[int, List[int]]] = {}
+
+    for session_id, id_in_subsession, round_number, best_guess, guess in Player.objects_filter(
+        Player.session_id.in_(session_ids), Player.guess != None
+    ).join(Group, Player.group_id == Group.id).with_entities(
+        Player.session_id, Group.id_in_subsession, Player.round_number, Group.best_guess, Player.guess
+    ):
+        key = (session_id, id_in_subsession)
+        if key in HISTOGRAMS:
+            continue
+
+        # Groups past their last round no longer have a live histogram
+        if round_number == C.NUM_ROUNDS and best_guess is not None:
+            latest[key] = (round_number, None)
+            continue
+
+        round_before, guesses = latest.get(key, (0, []))
+        if round_number > round_before:
+            latest[key] = (round_number, [guess])
+        elif round_number == round_before and guesses is not None:
+            guesses.append(guess)
+
+    for key, (round_number, guesses) in latest.items():
+        if guesses is not None:
+            HISTOGRAMS[key] = (round_number, histogram_bins(guesses))
+
+
+class HistogramSocket(WebSocketEndpoint):
+    """Socket of an admin report receiving histogram updates of a session, only aggregated counts are sent."""
+
+    async def on_connect(self, websocket):
+        # Same as oTree's sockets, sending to a closed socket is not an error
+        websocket.send = channel_utils.wrap_websocket_send(websocket.send)
+        await websocket.accept()
+        channel_utils.channel_layer.add(histogram_channel(self.scope['path_params']['session_id']), websocket)
+
+    async def on_disconnect(self, websocket, close_code):
+        channel_utils.channel_layer.discard(histogram_channel(self.scope['path_params']['session_id']), websocket)
+
+
+websocket_routes.append(WebSocketRoute(HISTOGRAM_PATH, HistogramSocket))
 
 
 class Player(BasePlayer):
@@ -67,6 +166,29 @@ class Player(BasePlayer):
     )
     is_winner = BooleanField(initial=False)
 
+    def record_guess(self) -> None:
+        """Add guess to the live histogram of the group's current round."""
+        group = self.group
+        key = (self.session.id, group.id_in_subsession)
+        round_number, counts = HISTOGRAMS.get(key, (0, None))
+
+        # Groups advance on their own, each one starts over once its first guess of a new round comes in
+        if round_number != self.round_number:
+            # Catch up on guesses submitted before a restart
+            counts = histogram_bins(guess for guess, in Player.objects_filter(
+                Player.guess != None, Player.id != self.id, group=group
+            ).with_entities(Player.guess))
+
+            HISTOGRAMS[key] = (self.round_number, counts)
+
+        if self.field_maybe_none('guess') is not None:
+            counts[self.guess // C.HISTOGRAM_BIN] += 1
+
+        # Push the group's histogram to open admin reports instead of having them reload
+        channel_utils.sync_group_send(group=histogram_channel(self.session.id), data=dict(
+            session=self.session.id, group=group.id_in_subsession, round=self.round_number, counts=counts,
+        ))
+
 
 # PAGES
 class Introduction(Page):
@@ -93,21 +215,23 @@ class Guess(Page):
         if timeout_happened:
             player.guess = None
 
+        player.record_guess()
+
 
 class ResultsWaitPage(WaitPage):
     """Wait for group and compute result."""
 
     def after_all_players_arrive(group: Group) -> None:
         """Determine payoff for round."""
-        players = group.get_players()
-
-        # Filter out players whose guess is None
-        players_with_guess = [p for p in players if p.field_maybe_none('guess') is not None]
+        # Gather all valid guesses in one column query without loading players
+        rows = Player.objects_filter(Player.guess != None, group=group).order_by(
+            Player.id_in_group
+        ).with_entities(Player.id, Player.guess).all()
 
         # Proceed only if there are players who made a guess
-        if players_with_guess:
+        if rows:
             # Calculate two_thirds_avg with players who made a guess
-            guesses = [p.field_maybe_none('guess') for p in players_with_guess]
+            guesses = [guess for _, guess in rows]
             two_thirds_avg = (2 / 3) * sum(guesses) / len(guesses)
             group.two_thirds_avg = round(two_thirds_avg, 2)
 
@@ -115,17 +239,29 @@ class ResultsWaitPage(WaitPage):
             group.best_guess = min(guesses, key=lambda guess: abs(guess - group.two_thirds_avg))
 
             # Determine winners
-            winners = [p for p in players_with_guess if p.guess == group.best_guess]
+            winners = [pid for pid, guess in rows if guess == group.best_guess]
             group.num_winners = len(winners)
-            for p in winners:
-                p.is_winner = True
-                p.payoff = C.JACKPOT / group.num_winners
+
+            # Only winners are loaded, payoffs are stored as text and can't be added up in SQL
+            share = C.JACKPOT / group.num_winners
+
+            for player in Player.objects_filter(Player.id.in_(winners)):
+                player.is_winner = True
+                player.payoff = share
         else:
             # Handle the case where no players made a guess
             group.two_thirds_avg = None
             group.best_guess = None
             group.num_winners = 0
 
+        group.extend_history()
+
+        # Live histogram is of no use once the group played its last round
+        if group.round_number == C.NUM_ROUNDS:
+            HISTOGRAMS.pop((group.session_id, group.id_in_subsession), None)
+
+        reports.invalidate(group.session)
+
 
 class Results(Page):
     """Display result to players."""
@@ -133,34 +269,10 @@ class Results(Page):
     timeout_seconds = 20
 
 
+@timed
 def creating_session(subsession):
     if subsession.round_number == 1:
-        players = subsession.get_players()
-
-        factor = math.floor(len(players) / 6)
-
-        group_1 = factor * 3 + len(players) % 6
-        if factor > 1:
-            group_2 = factor * 2
-
-            if factor > 2:
-                group_3 = factor
-            else:
-                group_3 = 0
-                group_1 += factor
-        else:
-            group_2 = 0
-            group_3 = 0
-            group_1 += factor * 3
-
-        matrix = [list(range(1, group_1 + 1))]
-        if group_2:
-            matrix += [list(range(group_1 + 1, group_1 + group_2 + 1))]
-
-            if group_3:
-                matrix += [list(range(group_1 + group_2 + 1, group_1 + group_2 + group_3 + 1))]
-
-        subsession.set_group_matrix(matrix)
+        group_by_config(subsession, ratios=C.GROUP_RATIOS, minimum=C.GROUP_MIN_SIZE)
     else:
         subsession.group_like_round(1)
 
@@ -171,32 +283,36 @@ page_sequence = [Introduction, Guess, ResultsWaitPage, Results]
 def vars_for_admin_report(subsession):
     session = subsession.session
 
-    group_sizes = [g.size for g in subsession.get_groups()]
+    groups = reports.columns(Group, session, C.NUM_ROUNDS, 'id', 'session_id', 'id_in_subsession', 'best_guess')
+    players = reports.columns(Player, session, C.NUM_ROUNDS, 'group_id')
 
-    group1_size = group_sizes[0]
-    group2_size = group_sizes[1] if len(group_sizes) > 1 else 0
-    group3_size = group_sizes[2] if len(group_sizes) > 2 else 0
+    # Groups stay the same across rounds
+    sizes = Counter(players[0]['group_id'])
+    group_sizes = [sizes[gid] for gid in groups[0]['id']]
+    group_best = zip(*[r['best_guess'] for r in groups])
 
-    group1_best = [None] * C.NUM_ROUNDS
-    group2_best = [None] * C.NUM_ROUNDS
-    group3_best = [None] * C.NUM_ROUNDS
+    # Guesses of the round each group is playing, kept up to date and only queried after a restart
+    keys = list(zip(groups[0]['session_id'], groups[0]['id_in_subsession']))
+    if any(key not in HISTOGRAMS for key in keys):
+        rebuild_histograms(sorted(set(groups[0]['session_id'])))
 
-    for round in range(1, C.NUM_ROUNDS + 1):
-        subsession = Subsession.objects_get(session=session, round_number=round)
-
-        best = [g.field_maybe_none('best_guess') for g in subsession.get_groups()]
-
-        i = round - 1
-        group1_best[i] = best[0]
-        group2_best[i] = best[1] if group2_size else None
-        group3_best[i] = best[2] if group3_size else None
+    histograms = [HISTOGRAMS.get(key, (None, None)) for key in keys]
 
     return dict(
-        group1_size=group1_size,
-        group2_size=group2_size,
-        group3_size=group3_size,
-
-        group1_best=json.dumps(group1_best),
-        group2_best=json.dumps(group2_best),
-        group3_best=json.dumps(group3_best),
+        groups=[
+            dict(
+                size=size,
+                session_id=session_id,
+                id_in_subsession=id_in_subsession,
+                best=json.dumps(list(best)),
+                histogram_round=json.dumps(histogram_round),
+                histogram=json.dumps(histogram),
+            )
+            for size, best, (histogram_round, histogram), (session_id, id_in_subsession)
+            in zip(group_sizes, group_best, histograms, keys)
+        ],
+        histogram_labels=json.dumps(histogram_labels()),
+        histogram_paths=json.dumps([
+            HISTOGRAM_PATH.format(session_id=session_id) for session_id in sorted(set(groups[0]['session_id']))
+        ]),
     )
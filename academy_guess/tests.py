@@ -1,33 +1,88 @@
 from otree.api import Currency as c, currency_range, expect, Bot, SubmissionMustFail
 from . import *
 
+from grouping import group_matrix, parse_ratios, ratio_matrix
+
+
+def legacy_partition(num_players):
+    """Hand-written 3/2/1 split the ratio grouping replaced, kept to check it still matches."""
+    factor = num_players // 6
+
+    group_1 = factor * 3 + num_players % 6
+    group_2 = group_3 = 0
+    if factor > 1:
+        group_2 = factor * 2
+
+        if factor > 2:
+            group_3 = factor
+        else:
+            group_1 += factor
+    else:
+        group_1 += factor * 3
+
+    return [size for size in [group_1, group_2, group_3] if size]
+
+
+def check_grouping(subsession):
+    """Check grouping of the session against its config and the matrix helpers against known splits."""
+    config = subsession.session.config
+    num_players = len(subsession.get_players())
+
+    if config.get('academy_players_per_group'):
+        expected = group_matrix(num_players, config['academy_players_per_group'])
+    else:
+        ratios = parse_ratios(config['academy_group_ratios']) if config.get('academy_group_ratios') else C.GROUP_RATIOS
+        expected = ratio_matrix(num_players, ratios, C.GROUP_MIN_SIZE)
+
+    expect(subsession.get_group_matrix(objects=False), expected)
+
+    for n in range(1, 2000):
+        expect([len(g) for g in ratio_matrix(n, C.GROUP_RATIOS, C.GROUP_MIN_SIZE)], legacy_partition(n))
+
+        for size in [2, 3, 5]:
+            sizes = [len(g) for g in group_matrix(n, size)]
+            expect(sum(sizes), n)
+            expect(len(sizes), max(1, n // size))
+            expect(max(sizes) - min(sizes), '<=', 1)
+
+    expect(group_matrix(0, 3), [])
+    expect(ratio_matrix(0, C.GROUP_RATIOS, C.GROUP_MIN_SIZE), [])
+
 
 class PlayerBot(Bot):
-    cases = ['p1_wins', 'p1_and_p2_win']
+    cases = ['p1_wins', 'p1_and_p2_win', 'grouping']
 
     def play_round(self):
         if self.round_number == 1:
             yield Introduction
 
-        if self.case == 'p1_wins':
+        if self.case == 'grouping':
+            if self.round_number == 1 and self.participant.id_in_session == 1:
+                check_grouping(self.subsession)
+            yield Guess, dict(guess=10)
+        elif self.case == 'p1_wins':
             if self.player.id_in_group == 1:
                 for invalid_guess in [-1, 101]:
                     yield SubmissionMustFail(Guess, dict(guess=invalid_guess))
                 yield Guess, dict(guess=9)
                 expect(self.player.payoff, C.JACKPOT)
+                expect(self.participant.payoff, C.JACKPOT * self.round_number)
                 expect('you win', 'in', self.html)
             else:
                 yield Guess, dict(guess=10)
                 expect(self.player.payoff, 0)
+                expect(self.participant.payoff, 0)
                 expect('you did not win', 'in', self.html)
         else:
             if self.player.id_in_group in [1, 2]:
                 yield Guess, dict(guess=9)
                 expect(self.player.payoff, C.JACKPOT / 2)
+                expect(self.participant.payoff, C.JACKPOT / 2 * self.round_number)
                 expect('you are one of the 2 winners', 'in', self.html)
             else:
                 yield Guess, dict(guess=10)
                 expect(self.player.payoff, 0)
+                expect(self.participant.payoff, 0)
                 expect('you did not win', 'in', self.html)
 
         yield Results
@@ -2,16 +2,23 @@
 
 from otree.constants import BaseConstants
 from otree.currency import Currency
-from otree.models import BaseSubsession, BaseGroup, BasePlayer
+from otree.models import BaseGroup, BasePlayer
 from otree.models_concrete import ChatMessage
-from otree.database import BooleanField
+from otree.database import db, BooleanField
 
 from otree.views import Page, WaitPage
 from otree.forms import widgets
 
+from bootstrap import BootstrapSubsession
 from wallet import Wallet
 
+from typing import Any, Dict, List, Optional, Tuple
+
 import json
+import payoffs
+import reports
+import shards
+import time
 
 
 doc = __doc__
@@ -30,9 +37,14 @@ class C(BaseConstants):
     PAYOFF_B = Currency(200)
     PAYOFF_C = Currency(100)
     PAYOFF_D = Currency(0)
+    # Payoff by own and opponent's choice, shared table
+    PAYOFFS = payoffs.prisoner_payoffs(PAYOFF_A, PAYOFF_B, PAYOFF_C, PAYOFF_D)
+    # Chat limits, maximum message length and minimum time between messages in s
+    CHAT_MAX_LENGTH = 500
+    CHAT_INTERVAL = 0.5
 
 
-class Subsession(BaseSubsession):
+class Subsession(BootstrapSubsession):
     """Default base subsession."""
 
     pass
@@ -68,6 +80,92 @@ class Player(BasePlayer):
         return self.get_others_in_group()[0]
 
 
+# CHAT RELAY
+# Sender participant and body of all messages by channel, restored after a restart
+CHAT_LOGS: Dict[str, List[Tuple[int, str]]] = {}
+
+# Time of last message by participant id
+CHAT_LAST_SENT: Dict[int, float] = {}
+
+
+class ChatRelay:
+    """Relay chat messages within a group in order, with sequence numbers.
+
+    Every message is committed before it is relayed, so a crash can only lose messages nobody has seen yet.
+    """
+
+    @staticmethod
+    def channel(group: Group) -> str:
+        """Return channel name as used by otree's chat."""
+        return f"{group.session_id}-{C.NAME_IN_URL}-{group.id}"
+
+    @staticmethod
+    def log(channel: str) -> List[Tuple[int, str]]:
+        """Return full message log of a channel, loading it once after a restart."""
+        if channel not in CHAT_LOGS:
+            CHAT_LOGS[channel] = ChatMessage.objects_filter(channel=channel).order_by(
+                ChatMessage.id
+            ).with_entities(ChatMessage.participant_id, ChatMessage.body).all()
+
+        return CHAT_LOGS[channel]
+
+    @staticmethod
+    def message(player: Player, seq: int, sender: int, body: str) -> dict:
+        """Format message as seen by a certain player."""
+        return dict(type='chat', seq=seq, mine=(sender == player.participant_id), body=body)
+
+    @staticmethod
+    def post(player: Player, body: Any) -> Dict[int, dict]:
+        """Append message to group log and return it for delivery to everybody in group."""
+        if not isinstance(body, str) or not body.strip():
+            return {player.id_in_group: dict(type='error', message="Empty message.")}
+
+        if len(body) > C.CHAT_MAX_LENGTH:
+            return {player.id_in_group: dict(
+                type='error', message=f"Message exceeds {C.CHAT_MAX_LENGTH} characters."
+            )}
+
+        now = time.time()
+        if now - CHAT_LAST_SENT.get(player.participant_id, 0) < C.CHAT_INTERVAL:
+            return {player.id_in_group: dict(type='error', message="You are sending too fast.")}
+
+        CHAT_LAST_SENT[player.participant_id] = now
+
+        channel = ChatRelay.channel(player.group)
+        log = ChatRelay.log(channel)
+
+        seq = len(log)
+        log.append((player.participant_id, body))
+
+        db.add(ChatMessage(
+            channel=channel,
+            participant_id=player.participant_id,
+            nickname=f"Participant {player.id_in_group}",
+            body=body,
+            timestamp=now,
+        ))
+        db.commit()
+
+        return {
+            p.id_in_group: ChatRelay.message(p, seq, player.participant_id, body)
+            for p in player.group.get_players()
+        }
+
+    @staticmethod
+    def sync(player: Player, offset: Any) -> Dict[int, dict]:
+        """Return all messages starting at offset to resync a client."""
+        log = ChatRelay.log(ChatRelay.channel(player.group))
+        offset = max(0, offset) if isinstance(offset, int) else 0
+
+        return {player.id_in_group: dict(
+            type='history',
+            messages=[
+                ChatRelay.message(player, seq, sender, body)
+                for seq, (sender, body) in enumerate(log[offset:], start=offset)
+            ],
+        )}
+
+
 # VIEWS
 class Introduction(Page):
     """Display instructions to players."""
@@ -96,9 +194,20 @@ class Decision(Page):
 
     @staticmethod
     def live_method(player: Player, message):
-        return {
-            player.opponent.id_in_group: message
-        }
+        """Relay chat messages and choice notifications within group."""
+        if not isinstance(message, dict):
+            return
+
+        if message.get('type') == 'chat':
+            return ChatRelay.post(player, message.get('body'))
+
+        if message.get('type') == 'sync':
+            return ChatRelay.sync(player, message.get('offset'))
+
+        if message.get('type') == 'chosen':
+            return {
+                player.opponent.id_in_group: dict(type='chosen')
+            }
 
     @staticmethod
     def before_next_page(player: Player, timeout_happened: bool):
@@ -111,17 +220,20 @@ class ResultsWait(WaitPage):
     @staticmethod
     def after_all_players_arrive(group: Group):
         """Determine payoff of current round."""
-        payoff_matrix = {
-            (False, True): C.PAYOFF_A,
-            (True, True): C.PAYOFF_B,
-            (False, False): C.PAYOFF_C,
-            (True, False): C.PAYOFF_D,
-        }
+        # Chat is over, all messages are in the database already
+        CHAT_LOGS.pop(ChatRelay.channel(group), None)
 
-        for player in group.get_players():
-            player.payoff = payoff_matrix[
-                (player.cooperate, player.opponent.cooperate)
-            ]
+        p1, p2 = group.get_players()
+
+        # Nobody chats after the last round, forget when they did
+        if group.round_number == C.NUM_ROUNDS:
+            CHAT_LAST_SENT.pop(p1.participant_id, None)
+            CHAT_LAST_SENT.pop(p2.participant_id, None)
+
+        p1.payoff = C.PAYOFFS[payoffs.prisoner_index(p1.cooperate, p2.cooperate)]
+        p2.payoff = C.PAYOFFS[payoffs.prisoner_index(p2.cooperate, p1.cooperate)]
+
+        reports.invalidate(group.session)
 
 
 class Results(Page):
@@ -133,86 +245,98 @@ class Results(Page):
 page_sequence = [Introduction, DecisionWait, Decision, ResultsWait, Results]
 
 
+# Chat messages by session id, with id of last message seen and messages by channel, for recent reports only
+CHATS: Dict[int, Tuple[int, Dict[str, List[Tuple[int, str]]]]] = reports.Cache(16)
+
+
+def chat_messages(session) -> Dict[str, List[Tuple[int, str]]]:
+    """Return sender and body of all chat messages in session by channel, only fetching new ones."""
+    last_id, channels = CHATS[session.id] if session.id in CHATS else (0, {})
+
+    # Message ids follow arrival order and allow an indexed range scan
+    query = ChatMessage.objects_filter(
+        ChatMessage.channel.startswith(f"{session.id}-{C.NAME_IN_URL}-"),
+        ChatMessage.id > last_id,
+    ).order_by(ChatMessage.id).with_entities(
+        ChatMessage.id, ChatMessage.channel, ChatMessage.participant_id, ChatMessage.body
+    )
+
+    for msg_id, channel, participant_id, body in query:
+        channels.setdefault(channel, []).append((participant_id, body))
+        last_id = msg_id
+
+    CHATS[session.id] = (last_id, channels)
+    return channels
+
+
 def vars_for_admin_report(subsession):
     session = subsession.session
 
-    # Compute cooperation ratios across rounds
-    ratio = []
-    for round in range(1, C.NUM_ROUNDS + 1):
-        subsession = Subsession.objects_get(session=session, round_number=round)
+    players = reports.columns(
+        Player, session, C.NUM_ROUNDS, 'session_id', 'group_id', 'id_in_group', 'participant_id', 'cooperate'
+    )
 
-        coop_yes = 0
-        coop_no = 0
-        for group in subsession.get_groups():
-            c1, c2 = [p.field_maybe_none('cooperate') for p in group.get_players()]
+    # Collect participant and choice of both players in each group per round
+    pairs = []
+    group_sessions = {}
+    for columns in players:
+        groups = {}
+        for session_id, group_id, id_in_group, participant_id, cooperate in zip(*columns.values()):
+            groups.setdefault(group_id, {})[id_in_group] = (participant_id, cooperate)
+            group_sessions[group_id] = session_id
 
-            if c1 is not None and c2 is not None:
-                if c1 and c2:
-                    coop_yes += 1
-                else:
-                    coop_no += 1
+        pairs += [groups]
 
-        try:
-            ratio += [100.0 * coop_yes / (coop_no + coop_yes)]
-        except:
-            ratio += [None]
+    # Compute cooperation ratios across rounds
+    ratio = []
+    for groups in pairs:
+        choices = [(g[1][1], g[2][1]) for g in groups.values()]
+        decided = [c1 and c2 for c1, c2 in choices if c1 is not None and c2 is not None]
+        ratio += [100.0 * sum(decided) / len(decided) if decided else None]
 
     # Extract chat messages and outcome
+    chats = {}
+    for shard in shards.siblings(session):
+        chats.update(chat_messages(shard))
+
+    def color(cooperate: Optional[bool]) -> Optional[str]:
+        if cooperate is None:
+            return None
+        return "success" if cooperate else "danger"
+
     all_names = {}
     all_chats = {}
 
-    for round in range(1, C.NUM_ROUNDS + 1):
-        subsession = Subsession.objects_get(session=session, round_number=round)
+    # Resolve names of all participants at once
+    wallets = Wallet.publics(set(players[0]['participant_id']))
 
+    for round, groups in enumerate(pairs, start=1):
         # For each group this round...
-        for group in subsession.get_groups():
-            [p1, p2] = group.get_players()
+        for group_id, group in groups.items():
+            (pp1, coop1), (pp2, coop2) = group[1], group[2]
 
             channel = "{}-{}-{}".format(
-                session.id, C.NAME_IN_URL, group.id
+                group_sessions[group_id], C.NAME_IN_URL, group_id
             )
 
-            coop1 = p1.field_maybe_none("cooperate")
-            coop2 = p2.field_maybe_none("cooperate")
+            # ... pairs stay the same, so only track their names once ...
+            if pp1 not in all_chats:
+                all_chats[pp1] = []
+                all_names[pp1] = (wallets[pp1], wallets[pp2])
 
-            name1 = Wallet.current(p1.participant).public
-            name2 = Wallet.current(p2.participant).public
+            name1, name2 = all_names[pp1]
 
-
-            for msg in ChatMessage.objects_filter().order_by('timestamp'):
-                print(msg.channel)
+            names = {pp1: name1, pp2: name2}
+            colors = {pp1: color(coop1), pp2: color(coop2)}
 
             # ... collect all message of group in round ...
-            messages = []
-            for msg in ChatMessage.objects_filter(channel=channel).order_by('timestamp'):
-
-                print(msg)
-
-                name = "Unknown"
-                color = None
-
-                if msg.participant == p1.participant:
-                    name = name1
-                    if coop1 is not None:
-                        color = "success" if coop1 else "danger"
-
-                elif msg.participant == p2.participant:
-                    name = name2
-                    if coop2 is not None:
-                        color = "success" if coop2 else "danger"
-
-                messages += [
-                    (name, color, msg.body)
-                ]
+            messages = [
+                (names.get(pp, "Unknown"), colors.get(pp), body)
+                for pp, body in chats.get(channel, [])
+            ]
 
             # ... and collect them for each participant pair
-            pp = p1.participant
-
-            if pp not in all_chats:
-                all_chats[pp] = []
-                all_names[pp] = (name1, name2)
-
-            all_chats[pp] += [(round, messages)]
+            all_chats[pp1] += [(round, messages)]
 
     chat_combined = []
 
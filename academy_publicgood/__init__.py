@@ -5,16 +5,22 @@ import settings
 
 from otree.constants import BaseConstants
 from otree.currency import Currency
-from otree.models import BaseSubsession, BaseGroup, BasePlayer
-from otree.database import db, CurrencyField, IntegerField
+from otree.models import BaseGroup, BasePlayer
+from otree.database import db, ExtraModel, Link, CurrencyField, IntegerField
 
 from otree.views import Page, WaitPage
 
 from otree.i18n import CURRENCY_SYMBOLS
 
-from typing import List, Optional
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from collections import Counter
+from bootstrap import BootstrapSubsession, timed
+from grouping import group_by_config
 
 import json
+import payoffs
+import reports
 
 
 doc = __doc__
@@ -30,17 +36,14 @@ def GET_CURRENCY_SYMBOL():
         return CURRENCY_SYMBOLS.get(code, code)
 
 
-def PUNISHMENT_COST_FUNCTION(percentage: int) -> Currency:
-    """Return cost of punishment, model by a quartered quadratic function."""
-    return Currency(round(0.25 * ((percentage / 10) + 1)**2))
-
-
 # Models
 class C(BaseConstants):
     """Cournot game constants."""
 
     NAME_IN_URL = 'academy_publicgood'
-    PLAYERS_PER_GROUP = 4
+    PLAYERS_PER_GROUP = None
+    # Default group size, can be overwritten by session config
+    GROUP_SIZE = 4
     NUM_ROUNDS = 10
     TITLE_PREFIX = "Lesson 2.2: "
     INSTRUCTIONS_TEMPLATE = 'academy_publicgood/instructions.html'
@@ -50,23 +53,69 @@ class C(BaseConstants):
     PUNISHMENT_STEP = 10
     PUNISHMENT_MAX = 100
 
-    cost = staticmethod(PUNISHMENT_COST_FUNCTION)
+    # Cost of every possible punishment percentage, shared table
+    COSTS = payoffs.punishment_costs(PUNISHMENT_MAX)
+
+    @staticmethod
+    def cost(percentage: int) -> Currency:
+        """Look up cost of punishment."""
+        return C.COSTS[percentage]
+
     COST_TABLE = {
         'columns': PUNISHMENT_MAX / PUNISHMENT_STEP + 2,
         'percentage': [f"{p}%" for p in range(0, PUNISHMENT_MAX + 1, PUNISHMENT_STEP)],
-        'cost': [int(PUNISHMENT_COST_FUNCTION(p)) for p in range(0, PUNISHMENT_MAX + 1, PUNISHMENT_STEP)],
+        'cost': [int(cost) for cost in COSTS[::PUNISHMENT_STEP]],
     }
     CURRENCY_SYMBOL = GET_CURRENCY_SYMBOL()
 
 
-class Subsession(BaseSubsession):
+class Subsession(BootstrapSubsession):
     """Default base subsession."""
 
-    def __init__(self, round_number, session):
-        session._set_admin_report_app_names()
-        super().__init__(round_number=round_number, session=session)
+    pass
+
+
+class MemberState(NamedTuple):
+    """Balances of a group member once all contributions are known."""
+
+    id_in_group: int
+    contribution: Currency
+    total: Currency
+    base: Currency
+    budget: Currency
+
+
+class RoundState(NamedTuple):
+    """Snapshot of a group's round once all contributions are known."""
+
+    session_id: int
+    round_number: int
+    total_contribution: Currency
+    individual_share: Currency
+    members: List[MemberState]
+
+    @property
+    def total_public_good(self) -> Currency:
+        """Return total contribution after multiplier was applied."""
+        return self.total_contribution * C.MULTIPLIER
+
+    @property
+    def size(self) -> int:
+        """Return number of players in group."""
+        return len(self.members)
+
+    def member(self, id_in_group: int) -> MemberState:
+        """Return state of a specific member."""
+        return self.members[id_in_group - 1]
+
+    def others(self, id_in_group: int) -> List[MemberState]:
+        """Return state of all other members."""
+        return [m for m in self.members if m.id_in_group != id_in_group]
+
+
+# Round state by group id, computed once per round and rebuilt after a restart
+ROUND_STATES: Dict[int, RoundState] = {}
 
-        db.commit()
 
 class Group(BaseGroup):
     """Track total contributions and its distribution."""
@@ -79,13 +128,51 @@ class Group(BaseGroup):
         """Return total contribution after multiplier was applied."""
         return self.total_contribution * C.MULTIPLIER
 
+    @property
+    def size(self) -> int:
+        """Return number of players in group."""
+        state = ROUND_STATES.get(self.id)
+        if state:
+            return state.size
 
-def PunishmentField(id_in_group):
-    """Create player id specific punishment fields."""
-    return IntegerField(
-        min=0, max=C.PUNISHMENT_MAX,
-        label="Punishment for Player {}".format(id_in_group)
-    )
+        return len(self.get_players())
+
+    @property
+    def state(self) -> RoundState:
+        """Return cached state of round, rebuilt from the database if necessary."""
+        return ROUND_STATES.get(self.id) or self.snapshot(self.get_players())
+
+    def snapshot(self, players: List["Player"]) -> RoundState:
+        """Compute and cache balances of all members based on their contributions."""
+        members = []
+        for p in players:
+            base = C.ENDOWMENT_ROUND - p.contribution + self.individual_share
+            members.append(MemberState(p.id_in_group, p.contribution, p.total, base, p.total + base))
+
+        state = RoundState(
+            self.session_id, self.round_number, self.total_contribution, self.individual_share, members
+        )
+        ROUND_STATES[self.id] = state
+
+        # Drop states of earlier rounds, they are rebuilt should a slow group still need them
+        outdated = [
+            key for key, other in ROUND_STATES.items()
+            if other.session_id == self.session_id and other.round_number < self.round_number - 1
+        ]
+        for key in outdated:
+            del ROUND_STATES[key]
+
+        return state
+
+    def punishment_matrix(self, players: List["Player"]) -> List[List[int]]:
+        """Load punishments as matrix of punisher by target, in order of players."""
+        index = {p.id_in_group: i for i, p in enumerate(players)}
+        matrix = [[0] * len(players) for _ in players]
+
+        for punishment in Punishment.objects_filter(group=self):
+            matrix[index[punishment.punisher]][index[punishment.target]] = punishment.amount
+
+        return matrix
 
 
 class Player(BasePlayer):
@@ -99,12 +186,6 @@ class Player(BasePlayer):
         min=0, max=C.ENDOWMENT_ROUND, label="How much will you contribute?"
     )
 
-    # Track punishments between players
-    punishment_player1 = PunishmentField(1)
-    punishment_player2 = PunishmentField(2)
-    punishment_player3 = PunishmentField(3)
-    punishment_player4 = PunishmentField(4)
-
     punishment_received = IntegerField()
 
     # Track loss/cost of punishment received and sent
@@ -116,23 +197,55 @@ class Player(BasePlayer):
         return C.ENDOWMENT_ROUND - self.contribution
 
     @property
-    def punishment_field(self) -> str:
-        """Return name of field containing player's punishment."""
-        return f"punishment_player{self.id_in_group}"
+    def round_state(self) -> RoundState:
+        """Return round state of group, without loading the group if cached."""
+        return ROUND_STATES.get(self.group_id) or self.group.state
+
+    @property
+    def state(self) -> MemberState:
+        """Return own balances from the round state of the group."""
+        return self.round_state.member(self.id_in_group)
 
     @property
     def punishment_budget(self) -> int:
         """Return the points available for punishment."""
-        return self.total + self.punishment_base
+        return self.state.budget
 
     @property
     def punishment_base(self) -> int:
         """Return base point used to compute punishment."""
-        return C.ENDOWMENT_ROUND - self.contribution + self.group.individual_share
+        return self.state.base
+
+    @property
+    def others(self) -> List[MemberState]:
+        """Return balances of other group members from the round state."""
+        return self.round_state.others(self.id_in_group)
+
+
+class Punishment(ExtraModel):
+    """Punishment one player directed at another, only stored if not zero."""
+
+    group = Link(Group)
+    # Who punished whom, by id in group
+    punisher = IntegerField()
+    target = IntegerField()
+    # Punishment in percent
+    amount = IntegerField()
+
+    @staticmethod
+    def submit(player: Player, amounts: Dict[int, int]) -> None:
+        """Replace punishments of a player with the given ones by target, inserted in one batch."""
+        Punishment.objects_filter(
+            Punishment.group_id == player.group.id,
+            Punishment.punisher == player.id_in_group,
+        ).delete(synchronize_session=False)
+
+        # Plain mappings are inserted as one batch, objects would be inserted one by one for their ids
+        db._db.bulk_insert_mappings(Punishment, [
+            dict(group_id=player.group_id, punisher=player.id_in_group, target=target, amount=amount)
+            for target, amount in amounts.items() if amount
+        ])
 
-    def punishment_for(self, player: "Player") -> int:
-        """Return punishment directed at specific player."""
-        return getattr(self, player.punishment_field)
 
 # PAGES
 class Introduction(Page):
@@ -145,6 +258,11 @@ class Introduction(Page):
         """Only displayed during first round."""
         return player.round_number == 1
 
+    @staticmethod
+    def vars_for_template(player: Player) -> dict:
+        """Provide group size for the instructions."""
+        return dict(group_size=player.group.size)
+
     @staticmethod
     def before_next_page(player: Player, timeout_happened: bool):
         """Provide participant with initial endowment."""
@@ -164,6 +282,7 @@ class Contribute(Page):
         """Provide endowment details."""
         return dict(
             balance_before=player.participant.payoff + C.ENDOWMENT_ROUND,
+            group_size=player.group.size,
         )
 
     @staticmethod
@@ -178,57 +297,88 @@ class ContributeWait(WaitPage):
     @staticmethod
     def after_all_players_arrive(group: Group) -> None:
         """Determine endowment and individual shares based on contributions."""
-        for p in group.get_players():
+        players = group.get_players()
+        for p in players:
             p.total = p.participant.payoff
 
-        group.total_contribution = sum(p.contribution for p in group.get_players())
+        group.total_contribution = sum(p.contribution for p in players)
         group.individual_share = (
-            group.total_contribution * C.MULTIPLIER / C.PLAYERS_PER_GROUP
+            group.total_contribution * C.MULTIPLIER / len(players)
         )
 
+        group.snapshot(players)
+
 
 class Punish(Page):
     """Collect punishments from players."""
 
-    form_model = 'player'
-
     timeout_seconds = 45
 
     @staticmethod
-    def get_form_fields(player: Player) -> List[str]:
-        """Exclude players own punishment field."""
-        return [p.punishment_field for p in player.get_others_in_group()]
+    def validate(player: Player, amounts: Dict[int, int]) -> Optional[str]:
+        """Check punishments by target against limits and the available budget."""
+        if any(not 0 <= a <= C.PUNISHMENT_MAX for a in amounts.values()):
+            return f"Punishments need to be between 0% and {C.PUNISHMENT_MAX}%."
 
-    @staticmethod
-    def error_message(player: Player, values: dict) -> Optional[str]:
-        punishments = [values[field] for field in Punish.get_form_fields(player)]
-        cost = sum(C.cost(p) for p in punishments)
+        cost = sum(C.cost(a) for a in amounts.values())
         budget = player.punishment_budget
 
         if cost and cost > budget:
             return f"Total cost of punishment ({cost}) exceeds available funds ({budget})."
 
+    @staticmethod
+    def live_method(player: Player, data: dict) -> dict:
+        """Validate and store punishments before the page is submitted."""
+        others = [m.id_in_group for m in player.others]
+        punishments = data.get('punishments', {})
+
+        try:
+            amounts = {target: int(punishments.get(str(target), 0)) for target in others}
+        except (TypeError, ValueError):
+            return {player.id_in_group: dict(type="error", message="Punishments need to be whole numbers.")}
+
+        error = Punish.validate(player, amounts)
+        if error:
+            return {player.id_in_group: dict(type="error", message=error)}
+
+        Punishment.submit(player, amounts)
+
+        return {player.id_in_group: dict(type="accepted")}
+
+    @staticmethod
+    def error_message(player: Player, values: dict) -> Optional[str]:
+        """Check stored punishments again on submit, the page itself may be posted without the live channel."""
+        amounts = {
+            punishment.target: punishment.amount for punishment in Punishment.objects_filter(
+                Punishment.group_id == player.group_id,
+                Punishment.punisher == player.id_in_group,
+            )
+        }
+
+        return Punish.validate(player, amounts)
 
     @staticmethod
     def vars_for_template(player: Player) -> dict:
-        """Provide other players and punishment schedule."""
+        """Provide other players, punishment schedule and the group's round state."""
         return dict(
-            other_players=player.get_others_in_group(),
+            other_players=player.others,
+            round_state=player.round_state,
+            group_size=player.round_state.size,
         )
 
     @staticmethod
     def js_vars(player: Player) -> dict:
-        """Return player ids and punishment bases for js calculation."""
+        """Return player ids, punishment bases and costs for js calculation."""
         return dict(
-            player_ids=[p.id_in_group for p in player.get_others_in_group()],
-            punishment_bases=[p.punishment_base for p in player.get_others_in_group()],
+            player_ids=[m.id_in_group for m in player.others],
+            punishment_bases=[m.base for m in player.others],
+            punishment_costs=[int(cost) for cost in C.COSTS],
         )
 
     @staticmethod
     def before_next_page(player: Player, timeout_happened: bool):
         if timeout_happened:
-            for p in player.get_others_in_group():
-                setattr(player, p.punishment_field, 0)
+            Punishment.submit(player, {})
 
 
 class PunishWait(WaitPage):
@@ -236,21 +386,23 @@ class PunishWait(WaitPage):
 
     def after_all_players_arrive(group: Group) -> None:
         """Determine reward based on punishment."""
-        for player in group.get_players():
-            others = player.get_others_in_group()
+        players = group.get_players()
+        matrix = group.punishment_matrix(players)
 
-            player.punishment_received = sum(
-                [o.punishment_for(player) for o in others]
-            )
+        state = group.state
+
+        for i, player in enumerate(players):
+            player.punishment_received = sum(row[i] for row in matrix)
 
             percentage = min(player.punishment_received, C.PUNISHMENT_MAX)
-            player.punishment_loss = round(player.punishment_base * (percentage / 100.0))
+            base = state.member(player.id_in_group).base
+            player.punishment_loss = round(base * (percentage / 100.0))
 
-            player.punishment_cost = sum(
-                [C.cost(player.punishment_for(o)) for o in others]
-            )
+            player.punishment_cost = sum(C.COSTS[p] for p in matrix[i])
 
-            player.payoff = player.punishment_base - player.punishment_loss - player.punishment_cost
+            player.payoff = base - player.punishment_loss - player.punishment_cost
+
+        reports.invalidate(group.session)
 
 
 class Results(Page):
@@ -263,7 +415,11 @@ class Results(Page):
         """Provide other players and punishment schedule."""
         percentage = min(player.punishment_received, C.PUNISHMENT_MAX)
 
-        return dict(percentage=percentage)
+        return dict(
+            percentage=percentage,
+            round_state=player.round_state,
+            group_size=player.round_state.size,
+        )
 
 
 page_sequence = [
@@ -276,27 +432,25 @@ page_sequence = [
 ]
 
 
-def vars_for_admin_report(subsession):
-    session = subsession.session
+@timed
+def creating_session(subsession: Subsession):
+    group_by_config(subsession, C.GROUP_SIZE)
 
-    contribute_avg = [None] * C.NUM_ROUNDS
-    punish_avg = [None] * C.NUM_ROUNDS
 
-    for round in range(1, C.NUM_ROUNDS + 1):
-
-        subsession = Subsession.objects_get(session=session, round_number=round)
-
-        contribute = [p.field_maybe_none('contribution') for p in subsession.get_players()]
-        contribute = [c for c in contribute if c is not None]
+def vars_for_admin_report(subsession):
+    session = subsession.session
 
-        if contribute:
-            contribute_avg[round - 1] = float(sum(contribute) / len(contribute))
+    players = reports.columns(Player, session, C.NUM_ROUNDS, 'group_id', 'contribution', 'punishment_received')
 
-        punish = [p.field_maybe_none('punishment_received') for p in subsession.get_players()]
-        punish = [p / 3 for p in punish if p is not None]
+    contribute_avg = [reports.mean(r['contribution']) for r in players]
 
-        if punish:
-            punish_avg[round - 1] = sum(punish) / len(punish)
+    # Average punishment per pair of players, only received punishments of completed rounds count
+    punish_avg = []
+    for r in players:
+        received = [(g, p) for g, p in zip(r['group_id'], r['punishment_received']) if p is not None]
+        sizes = Counter(g for g, _ in received)
+        pairs = sum(n * (n - 1) for n in sizes.values())
+        punish_avg.append(sum(p for _, p in received) / pairs if pairs else None)
 
     return dict(
         contribute=json.dumps(contribute_avg),
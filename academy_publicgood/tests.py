@@ -0,0 +1,65 @@
+from otree.api import Currency as c, currency_range, expect, Bot, Submission, SubmissionMustFail
+from . import *
+
+
+def call_live_method(method, page_class, case, round_number, group, **kwargs):
+    if page_class != Punish:
+        return
+
+    if case in ['accepted', 'timeout']:
+        result = method(1, dict(type='punish', punishments={'2': C.PUNISHMENT_STEP}))
+        expect(result[1]['type'], 'accepted')
+
+    if case == 'over_budget':
+        players = group.get_players()
+
+        def everyone_but(player):
+            return {str(p.id_in_group): C.PUNISHMENT_MAX for p in players if p != player}
+
+        if round_number == 1:
+            # Everyone punishes everyone fully, which the first budget still covers
+            for player in players:
+                result = method(player.id_in_group, dict(type='punish', punishments=everyone_but(player)))
+                expect(result[player.id_in_group]['type'], 'accepted')
+
+        if round_number == 2:
+            # Spending the first round left player 1 with less than a full punishment costs
+            result = method(1, dict(type='punish', punishments=everyone_but(players[0])))
+            expect(result[1]['type'], 'error')
+
+            # Punishments bypassing the live channel are rejected on submit
+            Punishment.submit(players[0], {int(t): a for t, a in everyone_but(players[0]).items()})
+
+
+class PlayerBot(Bot):
+    cases = ['accepted', 'over_budget', 'timeout']
+
+    def play_round(self):
+        if self.round_number == 1:
+            yield Introduction
+
+        yield Contribute, dict(contribution=C.ENDOWMENT_ROUND)
+
+        others = self.group.size - 1
+
+        if self.case == 'timeout':
+            # Timeout discards punishments accepted before
+            yield Submission(Punish, timeout_happened=True)
+        elif self.case == 'over_budget' and self.round_number == 2 and self.player.id_in_group == 1:
+            yield SubmissionMustFail(Punish)
+            yield Submission(Punish, timeout_happened=True)
+        else:
+            yield Punish
+
+        if self.case == 'accepted' and self.player.id_in_group == 1:
+            expect(self.player.punishment_cost, C.COSTS[C.PUNISHMENT_STEP])
+        elif self.case == 'accepted' and self.player.id_in_group == 2:
+            expect(self.player.punishment_received, C.PUNISHMENT_STEP)
+        elif self.case == 'over_budget' and self.round_number == 1:
+            expect(self.player.punishment_cost, C.COSTS[C.PUNISHMENT_MAX] * others)
+            expect(self.player.punishment_received, C.PUNISHMENT_MAX * others)
+        else:
+            expect(self.player.punishment_cost, 0)
+            expect(self.player.punishment_received, 0)
+
+        yield Results
@@ -3,11 +3,14 @@
 from otree.constants import BaseConstants
 
 from otree.api import models
-from otree.models import BaseSubsession, BaseGroup, BasePlayer
+from otree.models import BaseGroup, BasePlayer
 
 from otree.views import Page, WaitPage
 
+from bootstrap import BootstrapSubsession, timed
+
 import json
+import payoffs
 
 
 doc = __doc__
@@ -26,11 +29,12 @@ class Constants(BaseConstants):
     payoff_if_rejected = int(0)
     offer_increment = int(10)
 
-    offer_choices = range(0, endowment, offer_increment)
+    # Offers to responder and remaining reward of proposer, shared table
+    offer_choices, offer_rewards = payoffs.ultimatum_splits(endowment, offer_increment)
     num_offers = len(offer_choices)
 
 
-class Subsession(BaseSubsession):
+class Subsession(BootstrapSubsession):
     """Default base subsession."""
 
     pass
@@ -69,7 +73,7 @@ class PageWithInstructions(Page):
 
         return {
             'offers': Constants.offer_choices,
-            'reward': [Constants.endowment - o for o in Constants.offer_choices],
+            'reward': Constants.offer_rewards,
         }
 
 
@@ -153,6 +157,7 @@ page_sequence = [
     Results,
 ]
 
+@timed
 def creating_session(subsession):
     subsession.group_randomly()
 
@@ -7,19 +7,25 @@ from otree.database import (
     StringField,
     MixinSessionFK,
 )
-from otree.models import BaseSubsession, BaseGroup
+from otree.models import BaseGroup
 from otree.room import ROOM_DICT
 from otree.views import Page
 
+from bootstrap import BootstrapSubsession
 from wallet import Wallet, WalletError, WalletPlayer
 
 from typing import List, Optional
 
 import logging
+import rooms
+import shards
 
 
 logger = logging.getLogger('wallet')
 
+# Rooms take a pre-created session when opened and spread over shards, if enabled
+rooms.install()
+
 doc = __doc__
 
 
@@ -47,7 +53,7 @@ class C(BaseConstants):
         return model.session.config.get('academy_wallet_signin', False)
 
 
-class Subsession(BaseSubsession):
+class Subsession(BootstrapSubsession):
     """Default base subsession."""
 
     pass
@@ -88,8 +94,9 @@ class Authenticate(Page):
             # Check academy wallet room cookie
             room = ROOM_DICT.get("academy_wallet")
             if room and room.has_session():
-                cookie = f"session_{room.get_session().code}_participant"
-                code = request.session.get(cookie)
+                # Participant may have joined any shard of the wallet room
+                cookies = [f"session_{s.code}_participant" for s in shards.siblings(room.get_session())]
+                code = next((request.session[c] for c in cookies if request.session.get(c)), None)
                 if code:
                     wallet = Wallet.current_by_code(code)
                     if wallet:
@@ -164,15 +171,16 @@ def custom_export(all_players: List[Player]):
         'wallet_public',
         'wallet_payoff'
     ]
+    wallets = Wallet.publics([p.participant_id for p in all_players], placeholder=None)
+
     for player in all_players:
         session = player.session
         participant = player.participant
-        wallet = Wallet.current(participant)
 
         yield [
             session.code,
             session.config.get('academy_game_name'),
             participant.code,
-            wallet.public if wallet else None,
+            wallets[participant.id],
             participant.payoff_plus_participation_fee(),
         ]
@@ -0,0 +1,45 @@
+"""Hand work from any thread back to the server's event loop, e.g. to refill session pools."""
+
+from typing import Callable, Coroutine, List, Optional
+
+import asyncio
+
+
+# Event loop of the server, remembered at startup
+LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+# Callbacks to run once the server has started
+STARTUP: List[Callable[[], None]] = []
+
+
+def submit(coro: Coroutine) -> bool:
+    """Run coroutine on the server's event loop from any thread, return False if the loop is still unknown."""
+    if LOOP is None:
+        coro.close()
+        return False
+
+    asyncio.run_coroutine_threadsafe(coro, LOOP)
+    return True
+
+
+def at_startup(callback: Callable[[], None]) -> None:
+    """Run callback on the server's event loop once the server has started."""
+    STARTUP.append(callback)
+
+
+def install() -> None:
+    """Remember the server's event loop at startup, so worker threads can hand work back to it."""
+    from starlette.routing import Router
+
+    startup = Router.startup
+
+    async def startup_on_loop(router):
+        global LOOP
+        LOOP = asyncio.get_running_loop()
+
+        await startup(router)
+
+        for callback in STARTUP:
+            callback()
+
+    Router.startup = startup_on_loop
@@ -0,0 +1,87 @@
+"""Subsession base that fixes admin report app names once and times session creation per app."""
+
+from otree.database import db
+from otree.models import BaseSubsession, Session
+
+from sqlalchemy import event
+
+from typing import Callable, Dict, Optional, Tuple
+
+import functools
+import logging
+import time
+
+
+logger = logging.getLogger('academy')
+
+# App currently being built and when building it started, by session id
+CREATING: Dict[int, Tuple[str, float]] = {}
+
+# Time spent in creating_session of an app so far, by session id and app name
+SETUP: Dict[Tuple[int, str], float] = {}
+
+
+def checkpoint(session: Session, app_name: Optional[str] = None) -> None:
+    """Log build time of the previous app of a session and start timing the next one, if any."""
+    now = time.perf_counter()
+
+    previous = CREATING.pop(session.id, None)
+    if previous:
+        logger.info(f"bootstrap: '{session.code}' built {previous[0]} in {now - previous[1]:.3f}s")
+
+    if app_name:
+        CREATING[session.id] = (app_name, now)
+
+
+def timed(creating_session: Callable) -> Callable:
+    """Time an app's creating_session over all its rounds and log the total after the last one."""
+
+    @functools.wraps(creating_session)
+    def timed_creating_session(subsession: BaseSubsession):
+        session = subsession.session
+        app_name = subsession.get_folder_name()
+        key = (session.id, app_name)
+
+        # oTree builds all apps before calling any creating_session, which ends building the last app
+        checkpoint(session)
+
+        start = time.perf_counter()
+        try:
+            return creating_session(subsession)
+        finally:
+            SETUP[key] = SETUP.get(key, 0.0) + time.perf_counter() - start
+
+            if subsession.round_number == subsession._Constants.get_normalized('num_rounds'):
+                logger.info(f"bootstrap: '{session.code}' set up {app_name} in {SETUP.pop(key):.3f}s")
+
+    return timed_creating_session
+
+
+class BootstrapSubsession(BaseSubsession):
+    """BaseSubsession that fixes admin report app names once and reports build time per app.
+
+    oTree commits the subsessions of every app on its own, creation is not one transaction.
+    """
+
+    __abstract__ = True
+
+    def __init__(self, round_number: int, session: Session):
+        super().__init__(round_number=round_number, session=session)
+
+        if round_number != 1:
+            return
+
+        app_name = self.get_folder_name()
+        apps = session.config['app_sequence']
+
+        # Fix admin report app names once, committed together with the session
+        if app_name == apps[0]:
+            session._set_admin_report_app_names()
+
+        checkpoint(session, app_name)
+
+        if app_name == apps[-1]:
+            # Sessions of apps without a timed creating_session stop timing the last app at the final commit
+            @event.listens_for(db._db, 'after_commit', once=True)
+            def subsessions_committed(db_session) -> None:
+                event.listen(db_session, 'before_commit', lambda _: checkpoint(session), once=True)
@@ -0,0 +1,52 @@
+"""Presence-aware live broadcasts that only address subscribed group members."""
+
+from otree.models import BaseGroup
+
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+# Subscribed ids in group per live channel, None if lost since a restart
+SUBSCRIBERS: Dict[Tuple[int, str], Optional[Set[int]]] = {}
+
+
+def subscribe(group: BaseGroup, page: str, id_in_group: int, initial: bool = True) -> None:
+    """Register player as listening to the live channel of a group's page."""
+    channel = (group.id, page)
+
+    if channel not in SUBSCRIBERS:
+        # Traffic without prior announcement means subscriptions were lost
+        SUBSCRIBERS[channel] = set() if initial else None
+
+    members = SUBSCRIBERS[channel]
+    if members is not None:
+        members.add(id_in_group)
+
+
+def unsubscribe(group: BaseGroup, page: str, id_in_group: int) -> None:
+    """Remove player from live channel, e.g. after leaving the page."""
+    channel = (group.id, page)
+
+    members = SUBSCRIBERS.get(channel)
+    if members is not None:
+        members.discard(id_in_group)
+
+        if not members:
+            del SUBSCRIBERS[channel]
+
+
+def subscribers(group: BaseGroup, page: str) -> Set[int]:
+    """Return ids of all players listening to a group's page."""
+    members = SUBSCRIBERS.get((group.id, page))
+    if members is None:
+        # Unknown presence, fall back to whole group
+        return {p.id_in_group for p in group.get_players()}
+
+    return members
+
+
+def broadcast(group: BaseGroup, page: str, sender: int, status: str, payload: Any) -> Dict[int, tuple]:
+    """Return live method result with status for sender and an update for all other subscribers."""
+    return {
+        pid: (status if pid == sender else "update", payload)
+        for pid in subscribers(group, page) | {sender}
+    }
@@ -0,0 +1,66 @@
+"""Helpers to build otree group matrices from session configs."""
+
+from otree.models import BaseSubsession
+
+from typing import List, Optional, Sequence
+
+
+def sizes_matrix(sizes: Sequence[int]) -> List[List[int]]:
+    """Assign consecutive player ids to groups of the given sizes."""
+    matrix = []
+    start = 1
+    for size in sizes:
+        matrix.append(list(range(start, start + size)))
+        start += size
+
+    return matrix
+
+
+def group_matrix(num_players: int, size: int) -> List[List[int]]:
+    """Split player ids into as many groups of about size players as possible."""
+    if num_players <= 0:
+        return []
+
+    num_groups = max(1, num_players // size)
+
+    # Spread the remainder so group sizes differ by at most one
+    base, extra = divmod(num_players, num_groups)
+
+    return sizes_matrix([base + (1 if index < extra else 0) for index in range(num_groups)])
+
+
+def ratio_matrix(num_players: int, ratios: Sequence[int], minimum: int = 1) -> List[List[int]]:
+    """Split player ids into groups sized by ratios, too small groups are merged into the first."""
+    if num_players <= 0:
+        return []
+
+    unit = num_players // sum(ratios)
+    sizes = [ratio * unit for ratio in ratios[1:]]
+    rest = [size for size in sizes if size >= minimum]
+
+    # First group takes the rounding remainder and all groups below minimum
+    return sizes_matrix([num_players - sum(rest)] + rest)
+
+
+def parse_ratios(value: str) -> List[int]:
+    """Parse ratios from a session config string like '3,2,1'."""
+    return [int(r) for r in str(value).split(',') if r.strip()]
+
+
+def group_by_config(
+    subsession: BaseSubsession,
+    default: Optional[int] = None,
+    ratios: Optional[Sequence[int]] = None,
+    minimum: int = 1,
+) -> None:
+    """Group players based on the session's group size or ratios, falling back to defaults."""
+    config = subsession.session.config
+    size = config.get('academy_players_per_group', default)
+    ratios = parse_ratios(config['academy_group_ratios']) if config.get('academy_group_ratios') else ratios
+
+    num_players = len(subsession.get_players())
+
+    if size:
+        subsession.set_group_matrix(group_matrix(num_players, size))
+    elif ratios:
+        subsession.set_group_matrix(ratio_matrix(num_players, ratios, minimum))
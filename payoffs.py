@@ -0,0 +1,153 @@
+"""Cost and payoff tables of the games, computed once and indexed by discrete choice."""
+
+from otree.currency import Currency
+
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+import timeit
+
+
+Table = Tuple[Currency, ...]
+
+
+# PUBLIC GOODS
+def punishment_cost(percentage: int) -> Currency:
+    """Return cost of punishment, model by a quartered quadratic function."""
+    return Currency(round(0.25 * ((percentage / 10) + 1)**2))
+
+
+@lru_cache(maxsize=None)
+def punishment_costs(maximum: int) -> Table:
+    """Return cost of every punishment percentage up to maximum, indexed by percentage."""
+    return tuple(punishment_cost(p) for p in range(maximum + 1))
+
+
+# PRISONER'S DILEMMA
+def prisoner_index(cooperate: bool, other: bool) -> int:
+    """Return table index of own and opponent's choice."""
+    return 2 * cooperate + other
+
+
+@lru_cache(maxsize=None)
+def prisoner_payoffs(temptation: Currency, reward: Currency, punishment: Currency, sucker: Currency) -> Table:
+    """Return payoff of every combination of choices, indexed by prisoner_index()."""
+    table = [Currency(0)] * 4
+
+    table[prisoner_index(False, True)] = temptation
+    table[prisoner_index(True, True)] = reward
+    table[prisoner_index(False, False)] = punishment
+    table[prisoner_index(True, False)] = sucker
+
+    return tuple(table)
+
+
+# ULTIMATUM
+@lru_cache(maxsize=None)
+def ultimatum_splits(endowment: int, increment: int) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """Return every offer to the responder and the matching reward of the proposer."""
+    offers = tuple(range(0, endowment, increment))
+
+    return offers, tuple(endowment - o for o in offers)
+
+
+# COURNOT
+@lru_cache(maxsize=None)
+def cournot_prices(capacity: int, max_total: int) -> Table:
+    """Return unit price of every number of units produced in total, indexed by total units."""
+    return tuple(Currency(capacity - total) for total in range(max_total + 1))
+
+
+class Outcome(NamedTuple):
+    """Symmetric outcome of a cournot group where every firm produces the same units."""
+
+    units: int
+    total: int
+    price: int
+    payoff: int
+
+
+class CournotGrid:
+    """Payoff of every own units against total units of all others, for one capacity and group size."""
+
+    def __init__(self, capacity: int, max_units: int, players: int):
+        self.capacity = capacity
+        self.max_units = max_units
+        self.players = players
+
+        # Rows by own units, columns by units of all others together
+        others = range(max_units * (players - 1) + 1)
+        self.payoffs = tuple(
+            tuple((capacity - units - other) * units for other in others)
+            for units in range(max_units + 1)
+        )
+
+        # Lowest units with the highest payoff per column, i.e. units of the others
+        self.best_payoffs = tuple(max(column) for column in zip(*self.payoffs))
+        self.best_responses = tuple(
+            column.index(best) for column, best in zip(zip(*self.payoffs), self.best_payoffs)
+        )
+
+    def outcome(self, units: int) -> Outcome:
+        """Return outcome of all firms producing the same units."""
+        total = units * self.players
+        return Outcome(units, total, self.capacity - total, self.payoffs[units][total - units])
+
+    def is_best_response(self, units: int, others: int) -> bool:
+        """Check if no other units pay more against units of the others."""
+        return self.payoffs[units][others] == self.best_payoffs[others]
+
+    def nash(self) -> List[Outcome]:
+        """Return all symmetric equilibria, where every firm's units are a best response to the others."""
+        return [
+            self.outcome(units) for units in range(self.max_units + 1)
+            if self.is_best_response(units, units * (self.players - 1))
+        ]
+
+    def collusive(self) -> Outcome:
+        """Return symmetric outcome with the highest joint payoff, the lowest units on ties."""
+        return max(
+            (self.outcome(units) for units in range(self.max_units + 1)),
+            key=lambda outcome: (outcome.payoff, -outcome.units),
+        )
+
+
+@lru_cache(maxsize=None)
+def cournot_grid(capacity: int, max_units: int, players: int) -> CournotGrid:
+    """Return payoff grid of a cournot group, computed once per capacity and group size."""
+    return CournotGrid(capacity, max_units, players)
+
+
+# BENCHMARK
+def benchmark(number: int = 100000) -> Dict[str, Tuple[float, float]]:
+    """Time table lookups against computing the same values directly, in s per call."""
+    costs = punishment_costs(100)
+    prisoner = prisoner_payoffs(Currency(300), Currency(200), Currency(100), Currency(0))
+    splits = ultimatum_splits(100, 10)
+    prices = cournot_prices(60, 60)
+
+    def prisoner_direct():
+        matrix = {
+            (False, True): Currency(300),
+            (True, True): Currency(200),
+            (False, False): Currency(100),
+            (True, False): Currency(0),
+        }
+        return matrix[(True, False)]
+
+    cases: Dict[str, Tuple[Callable, Callable]] = {
+        'punishment cost': (lambda: punishment_cost(70), lambda: costs[70]),
+        'prisoner payoff': (prisoner_direct, lambda: prisoner[prisoner_index(True, False)]),
+        'ultimatum splits': (lambda: [100 - o for o in range(0, 100, 10)], lambda: splits[1]),
+        'cournot price': (lambda: Currency(60 - 42), lambda: prices[42]),
+    }
+
+    return {
+        name: (timeit.timeit(direct, number=number) / number, timeit.timeit(lookup, number=number) / number)
+        for name, (direct, lookup) in cases.items()
+    }
+
+
+if __name__ == '__main__':
+    for name, (direct, lookup) in benchmark().items():
+        print(f"{name:>16}: {direct * 1e9:8.1f}ns direct, {lookup * 1e9:8.1f}ns table, {direct / lookup:6.1f}x")
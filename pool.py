@@ -0,0 +1,129 @@
+"""Sessions created ahead of time per room, handed over instantly when the room is opened."""
+
+from otree.database import session_scope
+from otree.middleware import lock2
+from otree.models import Session
+from otree.room import ROOM_DICT
+from otree.session import SESSION_CONFIGS_DICT, create_session
+
+from typing import List, Optional, Set
+
+import asyncio
+import logging
+
+import background
+import settings
+
+
+logger = logging.getLogger('academy')
+
+# Label of sessions waiting in the pool of a room
+POOL_LABEL = "pool:{}"
+
+# Rooms with a refill already scheduled
+REFILLING: Set[str] = set()
+
+
+def pooled(room_name: str) -> List[Session]:
+    """Return ready sessions in the pool of a room, oldest first."""
+    return Session.objects_filter(label=POOL_LABEL.format(room_name)).order_by(Session.id).all()
+
+
+def take(room_name: str) -> Optional[Session]:
+    """Hand oldest pooled session over to a room, if there is one."""
+    sessions = pooled(room_name)
+    if not sessions:
+        return None
+
+    session = sessions[0]
+    session.label = ''
+    ROOM_DICT[room_name].set_session(session)
+
+    logger.info(f"pool: '{session.code}' handed over to {room_name}, {len(sessions) - 1} left")
+    return session
+
+
+def participants(room_name: str) -> int:
+    """Return number of participants of a pooled session, auctions only fit their fixed number of groups."""
+    config = SESSION_CONFIGS_DICT[room_name]
+
+    groups = sum(config.get(f"num_groups_{t}", 0) for t in settings.ACADEMY_AUCTION_TREATMENTS)
+    if groups:
+        return groups * config['academy_players_per_group']
+
+    return settings.ACADEMY_SESSION_POOL_PARTICIPANTS
+
+
+def create(room_name: str) -> bool:
+    """Create one pooled session for a room in its own transaction, return False once the pool is full."""
+    with session_scope():
+        if len(pooled(room_name)) >= settings.ACADEMY_SESSION_POOL_SIZE:
+            return False
+
+        session = create_session(
+            room_name,
+            num_participants=participants(room_name),
+            label=POOL_LABEL.format(room_name),
+        )
+        logger.info(f"pool: '{session.code}' created for {room_name}")
+
+    return True
+
+
+async def refill(room_name: str, delay: float) -> None:
+    """Top up the pool of a room in the background, one session at a time."""
+    try:
+        await asyncio.sleep(delay)
+
+        while True:
+            # Same lock as requests and live messages, so creation never interleaves with them,
+            # but created on a worker thread like any request, so sockets keep being served
+            async with lock2:
+                if not await asyncio.get_running_loop().run_in_executor(None, create, room_name):
+                    return
+
+            # Let pending requests through between sessions
+            await asyncio.sleep(0)
+    except Exception:
+        logger.exception(f"pool: failed to refill {room_name}")
+    finally:
+        REFILLING.discard(room_name)
+
+
+def schedule_refill(room_name: str, delay: float = 0) -> None:
+    """Refill pool of a room asynchronously, unless pooling is disabled or a refill is pending."""
+    if settings.ACADEMY_SESSION_POOL_SIZE <= 0 or room_name in REFILLING:
+        return
+
+    # Called from views running in worker threads, so hand the refill over to the server's loop
+    REFILLING.add(room_name)
+    if not background.submit(refill(room_name, delay)):
+        REFILLING.discard(room_name)
+
+
+def fill_all() -> None:
+    """Refill pools of all rooms."""
+    for room_name in ROOM_DICT:
+        schedule_refill(room_name)
+
+
+def install() -> None:
+    """Let rooms opened by the admin take a pooled session instead of creating one, only called by rooms.install."""
+    from otree.views.room import RoomWithoutSession
+
+    intercept_dispatch = RoomWithoutSession.intercept_dispatch
+
+    def take_pooled_session(view, room_name):
+        if settings.ACADEMY_SESSION_POOL_SIZE > 0 and not ROOM_DICT[room_name].has_session():
+            take(room_name)
+
+            # Wait for arriving participants to settle before adding load, even with an empty pool
+            schedule_refill(room_name, settings.ACADEMY_SESSION_POOL_DELAY)
+
+        # Redirects to the room's session if one was handed over
+        return intercept_dispatch(view, room_name)
+
+    RoomWithoutSession.intercept_dispatch = take_pooled_session
+
+    # Fill all pools while the server is still quiet after a start
+    background.at_startup(fill_all)
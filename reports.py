@@ -0,0 +1,83 @@
+"""Shared helpers to build admin reports from few, cached queries."""
+
+from otree.database import AnyModel
+from otree.models import Session
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Type
+
+import shards
+
+
+Columns = Dict[str, list]
+
+
+class Cache(OrderedDict):
+    """Dictionary that drops its least recently used entries beyond a maximum size.
+
+    Reports of finished sessions are never invalidated again, so their entries are only evicted by newer ones.
+    """
+
+    def __init__(self, size: int):
+        super().__init__()
+        self.size = size
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.size:
+            self.popitem(last=False)
+
+
+# Per round columns by model, session id and fields, for a few dozen reports at a time
+CACHE: Dict[Tuple[Type[AnyModel], int, Tuple[str, ...]], List[Columns]] = Cache(64)
+
+
+def columns(model: Type[AnyModel], session: Session, num_rounds: int, *fields: str) -> List[Columns]:
+    """Return fields of all rounds of a players or groups model as columns per round, fetched in one query.
+
+    Shards of a session are reported together.
+    """
+    key = (model, session.id, fields)
+    if key in CACHE:
+        return CACHE[key]
+
+    rounds = [{field: [] for field in fields} for _ in range(num_rounds)]
+
+    query = model.objects_filter(model.session_id.in_(shards.session_ids(session))).order_by(
+        model.round_number, model.id
+    ).with_entities(model.round_number, *[getattr(model, field) for field in fields])
+
+    for round_number, *values in query:
+        column = rounds[round_number - 1]
+        for field, value in zip(fields, values):
+            column[field].append(value)
+
+    CACHE[key] = rounds
+    return rounds
+
+
+def groups(model: Type[AnyModel], subsession) -> List[AnyModel]:
+    """Return groups of the subsession's round in all shards of its session, in order of creation."""
+    return model.objects_filter(
+        model.session_id.in_(shards.session_ids(subsession.session)),
+        round_number=subsession.round_number,
+    ).order_by(model.id).all()
+
+
+def invalidate(session: Session) -> None:
+    """Drop cached columns of a session and its shards, e.g. once a round was completed."""
+    ids = shards.session_ids(session)
+    for key in [key for key in CACHE if key[1] in ids]:
+        del CACHE[key]
+
+
+def mean(values: list) -> Optional[float]:
+    """Return average of all values that are set, None if there are none."""
+    values = [v for v in values if v is not None]
+    return float(sum(values) / len(values)) if values else None
@@ -0,0 +1,23 @@
+"""Room extensions patched into oTree's views: sessions created ahead of time and shards of one session."""
+
+import background
+import pool
+import shards
+
+
+# Views are patched once, importing apps again must not wrap them twice
+INSTALLED = False
+
+
+def install() -> None:
+    """Let rooms take pooled sessions and spread over shards, each only in effect if enabled in settings."""
+    global INSTALLED
+    if INSTALLED:
+        return
+
+    # Session pools hand refills from worker threads back to the server's loop
+    background.install()
+    pool.install()
+    shards.install()
+
+    INSTALLED = True
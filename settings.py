@@ -19,6 +19,7 @@ ACADEMY_AUCTION_DEFAULTS = dict(
     academy_wallet_code=True,
     academy_wallet_signin=True,
     real_world_currency_per_point=0.01,
+    academy_players_per_group=3,
     num_groups_hard=0,
     num_groups_candle=0,
     num_groups_activity=0,
@@ -53,6 +54,8 @@ ACADEMY_GAME_CONFIGS = {
         academy_game_name="Guessing Game",
         academy_wallet_code=True,
         academy_wallet_signin=True,
+        academy_players_per_group=0,
+        academy_group_ratios="3,2,1",
         academy_endcard_reward=320,
     ),
     'prisoner': dict(
@@ -65,6 +68,7 @@ ACADEMY_GAME_CONFIGS = {
     'publicgood': dict(
         num_demo_participants=4,
         academy_game_name="Public Good Game",
+        academy_players_per_group=4,
         academy_wallet_code=True,
         academy_wallet_signin=True,
         academy_endcard_reward=670,
@@ -74,6 +78,7 @@ ACADEMY_GAME_CONFIGS = {
         academy_game_name="Dollar Auction",
         academy_wallet_code=True,
         academy_wallet_signin=True,
+        academy_players_per_group=5,
         real_world_currency_per_point = 0.01,
     ),
     'auction' : ACADEMY_AUCTION_DEFAULTS | dict(
@@ -183,3 +188,13 @@ SECRET_KEY = '5192012476463'
 
 # Generate room config for each game
 ROOMS = list(map(AcademyGame.room, ACADEMY_GAMES))
+
+# Sessions kept ready per room, named like the room's game, 0 disables the pool
+ACADEMY_SESSION_POOL_SIZE = int(environ.get('ACADEMY_SESSION_POOL_SIZE', 0))
+# Participants per pooled session, auctions always get exactly their configured groups
+ACADEMY_SESSION_POOL_PARTICIPANTS = int(environ.get('ACADEMY_SESSION_POOL_PARTICIPANTS', 100))
+# Seconds to wait after a handover before refilling, to stay clear of arriving participants
+ACADEMY_SESSION_POOL_DELAY = int(environ.get('ACADEMY_SESSION_POOL_DELAY', 900))
+
+# Participants per session before a room opens another shard of it, 0 disables sharding
+ACADEMY_SHARD_SIZE = int(environ.get('ACADEMY_SHARD_SIZE', 0))
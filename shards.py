@@ -0,0 +1,97 @@
+"""Spread participants arriving in a room over parallel sessions of the same game."""
+
+from otree.models import Participant, Session
+from otree.room import ROOM_DICT
+from otree.session import create_session
+
+from starlette.responses import RedirectResponse
+
+from typing import List, Optional
+
+import logging
+
+import pool
+import settings
+
+
+logger = logging.getLogger('academy')
+
+# Label shared by all shards, by room and code of the first shard
+SHARD_LABEL = "shard:{}:{}"
+
+
+def is_shard(session: Session) -> bool:
+    """Check if session is one of several shards of a room."""
+    return (session.label or '').startswith("shard:")
+
+
+def siblings(session: Session) -> List[Session]:
+    """Return all shards the session belongs to, oldest first, or just the session itself."""
+    if not is_shard(session):
+        return [session]
+
+    return Session.objects_filter(label=session.label).order_by(Session.id).all()
+
+
+def session_ids(session: Session) -> List[int]:
+    """Return ids of all shards the session belongs to."""
+    return [s.id for s in siblings(session)]
+
+
+def returning(session: Session, cookies) -> Optional[Participant]:
+    """Find participant that already joined an earlier shard of the session."""
+    for shard in siblings(session):
+        code = cookies.get(f"session_{shard.code}_participant")
+        if code and shard.id != session.id:
+            return Participant.objects_filter(code=code).first()
+
+    return None
+
+
+def rotate(room_name: str, session: Session) -> Session:
+    """Hand the next shard of the room's session over to the room."""
+    if not is_shard(session):
+        session.label = SHARD_LABEL.format(room_name, session.code)
+
+    shard = pool.take(room_name)
+    if shard:
+        pool.schedule_refill(room_name, settings.ACADEMY_SESSION_POOL_DELAY)
+    else:
+        # Pool ran dry, so the arriving participant waits for the session to be created in its request,
+        # the very creation under load the pool exists to avoid, size the pool to the expected shards
+        shard = create_session(room_name, num_participants=session.num_participants, room_name=room_name)
+
+    shard.label = session.label
+
+    logger.info(f"shards: '{shard.code}' opened as shard {len(siblings(shard))} of {room_name}")
+    return shard
+
+
+def install() -> None:
+    """Let rooms switch to a new shard once their session reached the configured size, only called by rooms.install."""
+    from otree.views.participant import AssignVisitorToRoom
+
+    get = AssignVisitorToRoom.get
+
+    def dispatch_to_shard(view, request):
+        room = ROOM_DICT.get(request.path_params['room_name'])
+
+        # Rooms with participant labels map every label to one session
+        if settings.ACADEMY_SHARD_SIZE > 0 and room and not room.has_participant_labels:
+            session = room.get_session()
+
+            if session:
+                participant = returning(session, request.session)
+                if participant:
+                    return RedirectResponse(participant._start_url())
+
+                cookie = f"session_{session.code}_participant"
+                visited = Participant.objects_filter(session=session, visited=True).count()
+                limit = min(settings.ACADEMY_SHARD_SIZE, session.num_participants)
+
+                if not request.session.get(cookie) and visited >= limit:
+                    rotate(room.name, session)
+
+        return get(view, request)
+
+    AssignVisitorToRoom.get = dispatch_to_shard
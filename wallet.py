@@ -2,6 +2,7 @@
 
 from otree.currency import RealWorldCurrency
 from otree.database import (
+    db,
     ExtraModel,
     OTreeColumn,
     IntegerField,
@@ -12,7 +13,7 @@ from otree.database import (
 from otree.models import BasePlayer, Participant, Session
 
 from hashlib import sha256
-from typing import List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import sr25519
 import binascii
@@ -105,6 +106,33 @@ class Wallet(ExtraModel):
         owner = Participant.objects_first(code=code)
         return Wallet.current(owner) if owner else None
 
+    @staticmethod
+    def publics(owner_ids: Iterable[int], placeholder: Optional[str] = "Unknown") -> Dict[int, Optional[str]]:
+        """Resolve public keys of several participants by id in one query, with placeholder if missing."""
+        owner_ids = list(owner_ids)
+        found = dict(
+            Wallet.objects_filter(Wallet.id.in_(owner_ids)).with_entities(Wallet.id, Wallet._public)
+        )
+
+        return {id: found.get(id, placeholder) for id in owner_ids}
+
+    @staticmethod
+    def balances(owners: List[Participant]) -> Dict[int, RealWorldCurrency]:
+        """Compute wallet balances of several participants in one batch, keyed by participant id."""
+        wallets = Wallet.objects_filter(Wallet.id.in_([o.id for o in owners])).all()
+        publics = {w.id: w._public for w in wallets}
+
+        # Walk all associations of the requested wallets at once
+        totals = {}
+        for public, participant in db.query(Wallet._public, Participant).join(
+            Participant, Participant.id == Wallet.id
+        ).filter(Wallet._public.in_(set(publics.values()))):
+            totals[public] = totals.get(public, RealWorldCurrency(0)) + participant.payoff_plus_participation_fee()
+
+        return {
+            o.id: totals.get(publics.get(o.id), RealWorldCurrency(0)) for o in owners
+        }
+
     # Shorthand properties mostly for readable logic and templates
     @property
     def public(self) -> str: